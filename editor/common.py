@@ -25,6 +25,9 @@ import os
 import PyCEGUI
 from fife_rpg.components.fifeagent import FifeAgent
 
+CACHE_DIR_NAME = ".editor_cache"
+
+
 def cb_cut_copy_paste(args):
     """Event callback for text copy, cut and paste operations"""
     scancode = args.scancode
@@ -166,4 +169,14 @@ def get_entity(world, instance):
             break
     else:
         entity = None
-    return entity
\ No newline at end of file
+    return entity
+
+def get_cache_dir(project_dir):
+    """Returns the directory in which the editor stores cached data of a
+    project.
+
+    Args:
+
+        project_dir: The directory of the project
+    """
+    return os.path.join(project_dir, CACHE_DIR_NAME)
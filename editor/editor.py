@@ -20,8 +20,14 @@
 .. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
 """
 from builtins import object
+from builtins import next
+from collections import OrderedDict, Counter
+import time
+
 from fife import fife
 from .undo import UndoManager
+from .spatial_index import SpatialIndex
+from .import_references import ImportReferenceIndex
 
 
 class Editor(object):
@@ -37,12 +43,21 @@ class Editor(object):
                                            engine.getVFS(),
                                            engine.getImageManager(),
                                            engine.getRenderBackend())
-        self.__import_ref_count = {}
-        self.undo_manager = UndoManager()
+        self.import_references = ImportReferenceIndex()
+        self.__identifier_index = {}
+        self.__indexed_maps = {}
+        self.spatial_index = SpatialIndex()
+        self.undo_manager = UndoManager(context=self)
+        # Called with an instance, a section, a property name and a value
+        # when a property change is undone or redone
+        self.property_setter = None
 
     def reset_data(self):
         """Resets the internal data of the editor instance"""
-        self.__import_ref_count = {}
+        self.import_references.clear()
+        self.__identifier_index = {}
+        self.__indexed_maps = {}
+        self.spatial_index.clear()
 
     def create_map(self, identifier):
         """Creates a new map.
@@ -55,7 +70,9 @@ class Editor(object):
 
             The created map
         """
-        return self.__model.createMap(identifier)
+        fife_map = self.__model.createMap(identifier)
+        self.reset_map_index(fife_map)
+        return fife_map
 
     def load_map(self, filename):
         """Load a map from a file
@@ -67,13 +84,70 @@ class Editor(object):
         Returns:
             The loaded map
         """
+        start_time = time.time()
         fife_map = self.__map_loader.load(filename)
-        for layer in self.get_layers(fife_map):
-            for instance in self.get_instances_of_layer(layer):
-                self.increase_refcount(instance.getObject().getFilename(),
-                                       fife_map.getId())
+        load_time = time.time() - start_time
+        instance_count, index_time = self.index_map(fife_map)
+        print("Map %s: loaded in %.2fs, indexed %d instances in %.2fs" %
+              (fife_map.getId(), load_time, instance_count, index_time))
         return fife_map
 
+    def index_map(self, fife_map, skip=None):
+        """Builds the import reference counts, the identifier index and the
+        spatial index of a map in a single pass over its instances. Existing
+        data of the map is replaced.
+
+        Args:
+
+            fife_map: A fife.Map
+
+            skip: A function that is called with each instance and returns
+            True if the instance should not be added to the identifier and
+            spatial indexes. Skipped instances are still counted for the
+            import references.
+
+        Returns:
+
+            A tuple with the number of instances and the time the indexing
+            took in seconds
+        """
+        start_time = time.time()
+        map_name = fife_map.getId()
+        self.reset_map_index(fife_map)
+        map_index = self.__identifier_index[map_name]
+        objects = {}
+        object_counts = Counter()
+        instance_count = 0
+        for layer in fife_map.getLayers():
+            grid = self.spatial_index.get_grid(map_name, layer.getId(), True)
+            for instance in layer.getInstances():
+                instance_count += 1
+                fife_object = instance.getObject()
+                object_id = fife_object.getFifeId()
+                if object_id not in objects:
+                    objects[object_id] = fife_object
+                object_counts[object_id] += 1
+                if skip is not None and skip(instance):
+                    continue
+                self.__add_to_indexes(instance, instance.getLocation(), grid,
+                                      map_index)
+        file_counts = Counter()
+        for object_id, count in object_counts.items():
+            file_counts[objects[object_id].getFilename()] += count
+        self.import_references.rebuild_map(map_name, file_counts)
+        self.__indexed_maps[map_name] = fife_map.getFifeId()
+        return instance_count, time.time() - start_time
+
+    def is_map_indexed(self, fife_map):
+        """Returns whether index_map was called for the map
+
+        Args:
+
+            fife_map: A fife.Map
+        """
+        return self.__indexed_maps.get(fife_map.getId()) == \
+            fife_map.getFifeId()
+
     def delete_map(self, map_or_identifier):
         """Deletes a specific map.
 
@@ -87,10 +161,18 @@ class Editor(object):
         """
         if not isinstance(map_or_identifier, fife.Map):
             map_or_identifier = self.get_map(map_or_identifier)
+        self.spatial_index.remove_map(map_or_identifier.getId())
+        self.__identifier_index.pop(map_or_identifier.getId(), None)
+        self.__indexed_maps.pop(map_or_identifier.getId(), None)
+        self.import_references.remove_map(map_or_identifier.getId())
         self.__model.deleteMap(map_or_identifier)
 
     def delete_maps(self):
         """Deletes all maps"""
+        self.spatial_index.clear()
+        self.__identifier_index = {}
+        self.__indexed_maps = {}
+        self.import_references.clear()
         self.__model.deleteMaps()
 
     def get_maps(self):
@@ -156,7 +238,9 @@ class Editor(object):
                     fife_map.getId(), layer_name))
         if not isinstance(grid_type, fife.CellGrid):
             grid_type = self.get_cell_grid(grid_type)
-        return fife_map.createLayer(layer_name, grid_type)
+        layer = fife_map.createLayer(layer_name, grid_type)
+        self.get_layer_grid(layer, True)
+        return layer
 
     def delete_layer(self, fife_map_id, layer):
         """Deletes a layer from a map
@@ -176,6 +260,9 @@ class Editor(object):
             assert isinstance(fife_map, fife.Map)
         if not isinstance(layer, fife.Layer):
             layer = fife_map.getLayer(layer)
+        for instance in layer.getInstances():
+            self.unindex_instance(instance, layer)
+        self.spatial_index.remove_layer(fife_map.getId(), layer.getId())
         fife_map.deleteLayer(layer)
 
     def delete_layers(self, fife_map_id):
@@ -192,6 +279,7 @@ class Editor(object):
         fife_map = self.get_map(fife_map_id)
         if 0:  # Just for IDEs
             assert isinstance(fife_map, fife.Map)
+        self.reset_map_index(fife_map)
         fife_map.deleteLayers()
 
     def get_layers(self, map_or_identifier):
@@ -373,8 +461,64 @@ class Editor(object):
         tmp_filename = instance.getObject().getFilename()
         tmp_map_name = layer_or_layer_data.getMap().getId()
         self.increase_refcount(tmp_filename, tmp_map_name)
+        self.index_instance(instance)
         return instance
 
+    def create_instances(self, layer_or_layer_data, instance_data):
+        """Creates many instances on the given layer. The layer is resolved
+        only once, objects are looked up once per object and the reference
+        counts are updated once per file.
+
+        Args:
+
+            layer_or_layer_data: The layer or a tuple with 2 items: The name
+            of the layer and the map of the layer as a string or an map
+            instance.
+
+            instance_data: An iterable of tuples with the coordinates, the
+            object or object data and the name of each instance, like the
+            arguments of create_instance. The name can be None.
+
+        Returns:
+
+            A list of the created instances
+        """
+        if not isinstance(layer_or_layer_data, fife.Layer):
+            layer_or_layer_data = self.get_layer(layer_or_layer_data[1],
+                                                 layer_or_layer_data[0])
+        map_name = layer_or_layer_data.getMap().getId()
+        grid = self.spatial_index.get_grid(map_name,
+                                           layer_or_layer_data.getId(), True)
+        map_index = self.__identifier_index.setdefault(map_name, {})
+        objects = {}
+        file_counts = {}
+        instances = []
+        for coords, object_or_object_data, identifier in instance_data:
+            try:
+                iter(coords)
+                coords = fife.ExactModelCoordinate(*coords)
+            except TypeError:
+                pass
+            if isinstance(object_or_object_data, fife.Object):
+                key = object_or_object_data.getFifeId()
+            else:
+                key = tuple(object_or_object_data)
+            if key not in objects:
+                if not isinstance(object_or_object_data, fife.Object):
+                    object_or_object_data = self.__model.getObject(*key)
+                objects[key] = (object_or_object_data,
+                                object_or_object_data.getFilename())
+            fife_object, filename = objects[key]
+            instance = layer_or_layer_data.createInstance(fife_object, coords,
+                                                          identifier or "")
+            file_counts[filename] = file_counts.get(filename, 0) + 1
+            self.__add_to_indexes(instance, instance.getLocation(), grid,
+                                  map_index)
+            instances.append(instance)
+        for filename, count in file_counts.items():
+            self.increase_refcount(filename, map_name, count)
+        return instances
+
     def add_instance(self, instance, coords, layer_or_layer_data):
         """Adds an instance to a layer
 
@@ -406,6 +550,7 @@ class Editor(object):
         tmp_filename = instance.getObject().getFilename()
         tmp_map_name = layer_or_layer_data.getMap().getId()
         self.increase_refcount(tmp_filename, tmp_map_name)
+        self.index_instance(instance)
 
     def delete_instance(self, instance_or_identifier,
                         layer_or_layer_data=None):
@@ -439,6 +584,7 @@ class Editor(object):
         filename = instance_or_identifier.getObject().getFilename()
         map_name = layer_or_layer_data.getMap().getId()
         self.decrease_refcount(filename, map_name)
+        self.unindex_instance(instance_or_identifier, layer_or_layer_data)
         layer_or_layer_data.deleteInstance(instance_or_identifier)
 
     def remove_instance(self, instance_or_identifier,
@@ -477,11 +623,54 @@ class Editor(object):
         filename = instance_or_identifier.getObject().getFilename()
         map_name = layer_or_layer_data.getMap().getId()
         self.decrease_refcount(filename, map_name)
+        self.unindex_instance(instance_or_identifier, layer_or_layer_data)
         layer_or_layer_data.removeInstance(instance_or_identifier)
         return instance_or_identifier
 
+    def delete_instances(self, instances, layer_or_layer_data=None):
+        """Deletes many instances. The reference counts are decreased once
+        per file.
+
+        Args:
+
+            instances: An iterable of fife.Instance
+
+            layer_or_layer_data: The layer or a tuple with 2 items: The name
+            of the layer and the map of the layer as a string or an map
+            instance. If set all instances have to be on this layer,
+            otherwise the layer of each instance is looked up.
+
+        Raises:
+
+            ValueError if there was no map with that identifier.
+        """
+        map_name = None
+        if layer_or_layer_data is not None:
+            if not isinstance(layer_or_layer_data, fife.Layer):
+                layer_or_layer_data = self.get_layer(layer_or_layer_data[1],
+                                                     layer_or_layer_data[0])
+            map_name = layer_or_layer_data.getMap().getId()
+        filenames = {}
+        file_counts = {}
+        for instance in list(instances):
+            layer = layer_or_layer_data
+            instance_map_name = map_name
+            if layer is None:
+                layer = instance.getLocation().getLayer()
+                instance_map_name = layer.getMap().getId()
+            fife_object = instance.getObject()
+            object_id = fife_object.getFifeId()
+            if object_id not in filenames:
+                filenames[object_id] = fife_object.getFilename()
+            key = (filenames[object_id], instance_map_name)
+            file_counts[key] = file_counts.get(key, 0) + 1
+            self.unindex_instance(instance, layer, instance_map_name)
+            layer.deleteInstance(instance)
+        for (filename, instance_map_name), count in file_counts.items():
+            self.decrease_refcount(filename, instance_map_name, count)
+
     def delete_instances_of_map(self, map_or_identifier=None):
-        """Deletes all instances of the given layer.
+        """Deletes all instances of the given map.
 
         Returns:
 
@@ -492,12 +681,9 @@ class Editor(object):
 
             ValueError if there was no map with that identifier.
         """
-        instances = self.get_instances_of_map(map_or_identifier)
-        success = True
-        for instance in instances:
-            if not self.delete_instance(instance):
-                success = False
-        return success
+        for layer in self.get_layers(map_or_identifier):
+            self.delete_instances_of_layer(layer)
+        return True
 
     def delete_instances_of_layer(self, layer_or_layer_data):
         """Deletes all instances of the given layer.
@@ -517,12 +703,12 @@ class Editor(object):
 
             ValueError if there was no map with that identifier.
         """
+        if not isinstance(layer_or_layer_data, fife.Layer):
+            layer_or_layer_data = self.get_layer(layer_or_layer_data[1],
+                                                 layer_or_layer_data[0])
         instances = self.get_instances_of_layer(layer_or_layer_data)
-        success = True
-        for instance in instances:
-            if not self.delete_instance(instance):
-                success = False
-        return success
+        self.delete_instances(instances, layer_or_layer_data)
+        return True
 
     def get_instance(self, identifier, layer_or_identifier=None,
                      map_or_identifier=None):
@@ -548,6 +734,14 @@ class Editor(object):
             ValueError if there was no map with that identifier.
         """
         if layer_or_identifier is None:
+            if not isinstance(map_or_identifier, fife.Map):
+                map_or_identifier = self.get_map(map_or_identifier)
+            map_index = self.__identifier_index.get(map_or_identifier.getId(),
+                                                    {})
+            instances = map_index.get(identifier)
+            if instances:
+                return next(iter(instances.values()))
+            # Instances that are not managed by the editor are not indexed
             layers = self.get_layers(map_or_identifier)
             for layer in layers:
                 instance = self.get_instance(identifier, layer)
@@ -560,6 +754,50 @@ class Editor(object):
                                                      layer_or_identifier)
             return layer_or_identifier.getInstance(identifier)
 
+    def get_instances_by_identifiers(self, identifiers, map_or_identifier):
+        """Returns the instances with the given names from a map
+
+        Args:
+
+            identifiers: An iterable of names of instances
+
+            map_or_identifier: The map or the name of the map
+
+        Returns:
+
+            A dictionary that maps each name to the first instance with that
+            name on the map, or to None if there is no such instance.
+
+        Raises:
+
+            ValueError if there was no map with that identifier.
+        """
+        if not isinstance(map_or_identifier, fife.Map):
+            map_or_identifier = self.get_map(map_or_identifier)
+        map_index = self.__identifier_index.get(map_or_identifier.getId(), {})
+        result = {}
+        missing = []
+        for identifier in identifiers:
+            instances = map_index.get(identifier)
+            if instances:
+                result[identifier] = next(iter(instances.values()))
+            else:
+                missing.append(identifier)
+        for layer in self.get_layers(map_or_identifier):
+            if not missing:
+                break
+            not_found = []
+            for identifier in missing:
+                instance = layer.getInstance(identifier)
+                if instance is None:
+                    not_found.append(identifier)
+                else:
+                    result[identifier] = instance
+            missing = not_found
+        for identifier in missing:
+            result[identifier] = None
+        return result
+
     def get_instances_of_layer(self, layer_or_layer_data,
                                instance_identifier=None):
         """Returns a list of the instances of a layer
@@ -622,7 +860,193 @@ class Editor(object):
             coords.setExactLayerCoordinates(tmp_coords)
         else:
             layer = coords.getLayer()
-        return layer.getInstancesAt(coords)
+        grid = self.get_layer_grid(layer)
+        if grid is None:
+            return layer.getInstancesAt(coords)
+        cell = coords.getLayerCoordinates()
+        return grid.query_cell((cell.x, cell.y))
+
+    def get_instances_in_rect(self, layer_or_layer_data, min_coords,
+                              max_coords):
+        """Get all instances inside a rectangle
+
+        Args:
+
+            layer_or_layer_data: The layer or a tuple with 2 items: The name
+            of the layer and the map of the layer as a string or an map
+            instance.
+
+            min_coords: A tuple with the lowest x and y layer coordinates
+            of the rectangle
+
+            max_coords: A tuple with the highest x and y layer coordinates
+            of the rectangle
+
+        Raises:
+
+            ValueError if there was no map with that identifier.
+        """
+        if not isinstance(layer_or_layer_data, fife.Layer):
+            layer_or_layer_data = self.get_layer(layer_or_layer_data[1],
+                                                 layer_or_layer_data[0])
+        min_x, min_y = min_coords[:2]
+        max_x, max_y = max_coords[:2]
+        grid = self.get_layer_grid(layer_or_layer_data)
+        if grid is not None:
+            return grid.query_rect(min_x, min_y, max_x, max_y)
+        instances = []
+        for instance in layer_or_layer_data.getInstances():
+            coords = instance.getLocation().getExactLayerCoordinates()
+            if min_x <= coords.x <= max_x and min_y <= coords.y <= max_y:
+                instances.append(instance)
+        return instances
+
+    def get_instances_in_radius(self, layer_or_layer_data, center, radius):
+        """Get all instances inside a circle
+
+        Args:
+
+            layer_or_layer_data: The layer or a tuple with 2 items: The name
+            of the layer and the map of the layer as a string or an map
+            instance.
+
+            center: A tuple with the x and y layer coordinates of the center
+            of the circle
+
+            radius: The radius of the circle, in layer coordinates
+
+        Raises:
+
+            ValueError if there was no map with that identifier.
+        """
+        if not isinstance(layer_or_layer_data, fife.Layer):
+            layer_or_layer_data = self.get_layer(layer_or_layer_data[1],
+                                                 layer_or_layer_data[0])
+        center_x, center_y = center[:2]
+        grid = self.get_layer_grid(layer_or_layer_data)
+        if grid is not None:
+            return grid.query_radius((center_x, center_y), radius)
+        instances = []
+        for instance in layer_or_layer_data.getInstances():
+            coords = instance.getLocation().getExactLayerCoordinates()
+            distance_x = coords.x - center_x
+            distance_y = coords.y - center_y
+            if distance_x * distance_x + distance_y * distance_y <= (
+                    radius * radius):
+                instances.append(instance)
+        return instances
+
+    def get_layer_grid(self, layer, create=False):
+        """Returns the spatial index grid of a layer
+
+        Args:
+
+            layer: A fife.Layer
+
+            create: Whether to create the grid if the layer has none
+
+        Returns: The grid or None if the layer is not indexed
+        """
+        return self.spatial_index.get_grid(layer.getMap().getId(),
+                                           layer.getId(), create)
+
+    def reset_map_index(self, fife_map):
+        """Empties the spatial and identifier indexes of a map and creates
+        empty grids for its layers
+
+        Args:
+
+            fife_map: A fife.Map
+        """
+        self.spatial_index.remove_map(fife_map.getId())
+        self.__identifier_index[fife_map.getId()] = {}
+        for layer in fife_map.getLayers():
+            self.get_layer_grid(layer, True)
+
+    def index_instance(self, instance):
+        """Adds an instance to the spatial index of its layer and the
+        identifier index of its map
+
+        Args:
+
+            instance: A fife.Instance
+        """
+        location = instance.getLocation()
+        layer = location.getLayer()
+        map_name = layer.getMap().getId()
+        grid = self.spatial_index.get_grid(map_name, layer.getId(), True)
+        map_index = self.__identifier_index.setdefault(map_name, {})
+        self.__add_to_indexes(instance, location, grid, map_index)
+
+    def __add_to_indexes(self, instance, location, grid, map_index):
+        """Adds an instance to a spatial index grid and an identifier index
+
+        Args:
+
+            instance: A fife.Instance
+
+            location: The fife.Location of the instance
+
+            grid: The InstanceGrid of the layer of the instance
+
+            map_index: The identifier index of the map of the instance
+        """
+        cell = location.getLayerCoordinates()
+        exact = location.getExactLayerCoordinates()
+        grid.insert(instance.getFifeId(), (cell.x, cell.y),
+                    (exact.x, exact.y), instance)
+        identifier = instance.getId()
+        if identifier:
+            instances = map_index.setdefault(identifier, OrderedDict())
+            instances[instance.getFifeId()] = instance
+
+    def unindex_instance(self, instance, layer, map_name=None):
+        """Removes an instance from the spatial index of a layer and the
+        identifier index of its map. Instances that are managed elsewhere,
+        like the instances of entities, have to be removed from the indexes.
+
+        Args:
+
+            instance: A fife.Instance
+
+            layer: The fife.Layer the instance is on
+
+            map_name: The name of the map of the layer. Looked up if None.
+        """
+        if map_name is None:
+            map_name = layer.getMap().getId()
+        grid = self.spatial_index.get_grid(map_name, layer.getId())
+        if grid is not None:
+            grid.remove(instance.getFifeId())
+        map_index = self.__identifier_index.get(map_name)
+        if map_index is None:
+            return
+        identifier = instance.getId()
+        instances = map_index.get(identifier)
+        if instances is None:
+            return
+        instances.pop(instance.getFifeId(), None)
+        if not instances:
+            del map_index[identifier]
+
+    def set_instance_id(self, instance, identifier):
+        """Changes the name of an instance and updates the identifier index
+
+        Args:
+
+            instance: A fife.Instance
+
+            identifier: The new name of the instance
+        """
+        layer = instance.getLocation().getLayer()
+        grid = self.get_layer_grid(layer)
+        is_indexed = (grid is not None and
+                      instance.getFifeId() in grid.entries)
+        if is_indexed:
+            self.unindex_instance(instance, layer)
+        instance.setId(identifier)
+        if is_indexed:
+            self.index_instance(instance)
 
     def get_instances_of_map(self, map_or_identifier):
         """Returns a list of the instances of a map
@@ -640,10 +1064,10 @@ class Editor(object):
         layers = self.get_layers(map_or_identifier)
         instances = []
         for layer in layers:
-            instances.append(self.get_instances_of_layer(layer))
+            instances.extend(self.get_instances_of_layer(layer))
         return instances
 
-    def increase_refcount(self, filename, map_name=None):
+    def increase_refcount(self, filename, map_name=None, count=1):
         """Increase reference count for a file on a map
 
         Args:
@@ -651,16 +1075,12 @@ class Editor(object):
             filename: The filename the reference counter is for
 
             Map: The map the reference counter is for
+
+            count: By how much the counter is increased
         """
-        if map_name not in self.__import_ref_count:
-            self.__import_ref_count[map_name] = {}
-        ref_count = self.__import_ref_count[map_name]
-        if filename in ref_count:
-            ref_count[filename] += 1
-        else:
-            ref_count[filename] = 1
+        self.import_references.increase(filename, map_name, count)
 
-    def decrease_refcount(self, filename, map_name):
+    def decrease_refcount(self, filename, map_name, count=1):
         """Decrease reference count for a file on a map
 
         Args:
@@ -668,14 +1088,10 @@ class Editor(object):
             filename: The filename the reference counter is for
 
             Map: The map the reference counter is for
+
+            count: By how much the counter is decreased
         """
-        if map_name not in self.__import_ref_count:
-            return
-        ref_count = self.__import_ref_count[map_name]
-        if filename in ref_count:
-            ref_count[filename] -= 1
-            if ref_count[filename] <= 0:
-                del ref_count[filename]
+        self.import_references.decrease(filename, map_name, count)
 
     def get_import_list(self, map_name):
         """Returns the import files of the given map
@@ -684,10 +1100,17 @@ class Editor(object):
 
             map_name: The name of the map to the the imports for
         """
-        if map_name in self.__import_ref_count:
-            return iter(self.__import_ref_count[map_name].keys())
-        else:
-            return []
+        return self.import_references.get_files(map_name)
+
+    def get_maps_using_file(self, filename):
+        """Returns the names of the maps that have instances of objects from
+        a file
+
+        Args:
+
+            filename: The path to the object file
+        """
+        return self.import_references.get_maps(filename)
 
     def undo(self):
         """Undoes the last done action"""
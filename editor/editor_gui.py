@@ -26,7 +26,9 @@ from future.utils import iteritems
 standard_library.install_aliases()
 from builtins import str
 from builtins import object
+from copy import deepcopy
 import os
+import time
 import PyCEGUI
 import yaml
 
@@ -52,6 +54,7 @@ from .basic_toolbar import BasicToolbar
 from .property_editor import PropertyEditor
 from . import properties
 from .common import get_entity
+from .undo_editor import UndoChangeProperty
 
 class EditorGui(object):
 
@@ -202,6 +205,8 @@ class EditorGui(object):
         self.property_editor.add_remove_callback(self.cb_remove_component)
 
         self.previous_object = None
+        self.property_refresh_time = None
+        self.app.editor.property_setter = self.apply_property_value
 
         cegui_system.getDefaultGUIContext().setRootWindow(
             self.editor_window)
@@ -468,6 +473,11 @@ class EditorGui(object):
         self.toolbar.addTab(gui)
         self.toolbar.setSelectedTabAtIndex(0)
 
+    def shutdown_toolbars(self):
+        """Lets the toolbars clean up before the editor is closed"""
+        for toolbar in self.toolbars.values():
+            toolbar.shutdown()
+
     def update_toolbar_contents(self):
         """Updates the contents of the toolbars"""
         for toolbar in self.toolbars.values():
@@ -980,7 +990,10 @@ class EditorGui(object):
             self.app.hide_map_entities(self.app.current_map.name)
 
     def cb_value_changed(self, section, property_name, value):
-        """Called when the value of a properties changed
+        """Called when the value of a properties changed. The change is added
+        to the undo history. Changes that are merged into the previous one,
+        like the steps of a spinner, only update the instance; the property
+        editor is updated when no more changes follow.
 
         Args:
 
@@ -990,9 +1003,82 @@ class EditorGui(object):
 
             value: The new value of the properties
         """
-        identifier = self.app.selected_object.getId()
+        instance = self.app.selected_object
+        is_entity = get_entity(self.app.world, instance) is not None
+        if not is_entity and section != "Instance":
+            return
+        try:
+            old_value = self.get_property_value(instance, section,
+                                                property_name)
+        except Exception as error:  # pylint: disable=broad-except
+            # The change can still be made, but not undone
+            print(error)
+            self.set_property_value(instance, section, property_name, value)
+            self.update_property_editor()
+            return
+        old_identifier = instance.getId()
+        if not self.set_property_value(instance, section, property_name,
+                                       value):
+            self.update_property_editor()
+            return
+        undo_manager = self.app.editor.undo_manager
+        action = UndoChangeProperty(self.app.editor, instance, old_identifier,
+                                    section, property_name, old_value, value)
+        if undo_manager.add_action(action):
+            self.property_refresh_time = (time.time() +
+                                          undo_manager.merge_window)
+        else:
+            self.property_refresh_time = None
+            self.update_property_editor()
+
+    def get_property_value(self, instance, section, property_name):
+        """Returns a copy of the current value of a property
+
+        Args:
+
+            instance: The fife.Instance
+
+            section: The section of the property
+
+            property_name: The name of the property
+        """
         world = self.app.world
-        entity = get_entity(world, self.app.selected_object)
+        entity = get_entity(world, instance)
+        if entity is not None:
+            entity = world.get_entity(instance.getId())
+            return deepcopy(getattr(getattr(entity, section), property_name))
+        if property_name == "Identifier":
+            return instance.getId()
+        elif property_name == "CostId":
+            return instance.getCostId()
+        elif property_name == "Cost":
+            return instance.getCost()
+        elif property_name == "Blocking":
+            return instance.isBlocking()
+        elif property_name == "Rotation":
+            return instance.getRotation()
+        elif property_name == "StackPosition":
+            return instance.get2dGfxVisual().getStackPosition()
+        return None
+
+    def set_property_value(self, instance, section, property_name, value):
+        """Changes a property of an instance or its entity
+
+        Args:
+
+            instance: The fife.Instance
+
+            section: The section of the property
+
+            property_name: The name of the property
+
+            value: The new value of the property
+
+        Returns: True if the value was valid, False if not
+        """
+        identifier = instance.getId()
+        world = self.app.world
+        entity = get_entity(world, instance)
         if entity is not None:
             entity = world.get_entity(identifier)
             com_data = getattr(entity, section)
@@ -1000,7 +1086,7 @@ class EditorGui(object):
                 if (section == General.registered_as and property_name ==
                     "identifier" and value != identifier):
                     value = world.rename_entity(identifier, value)
-                    self.app.selected_object.setId(value)
+                    instance.setId(value)
                     old_dict = self.app.entities.pop(identifier)
                     self.app.entities[value] = old_dict
                 else:
@@ -1008,51 +1094,76 @@ class EditorGui(object):
                 self.app.update_agents(self.app.current_map)
                 self.app.entity_changed = True
             except (ValueError, yaml.parser.ParserError):
-                pass
+                return False
             except Exception as error:  # pylint: disable=broad-except
                 print(error)
-        else:
-            if section != "Instance":
-                return
-            is_valid = True
-            if property_name == "Identifier":
-                value = value
-                self.app.selected_object.setId(value)
-            elif property_name == "CostId":
-                cur_cost = self.app.selected_object.getCost()
-                try:
-                    value = value
-                    self.app.selected_object.setCost(value, cur_cost)
-                except UnicodeEncodeError:
-                    print("The CostId has to be an ascii value")
-                    is_valid = False
-            elif property_name == "Cost":
-                cur_cost_id = self.app.selected_object.getCostId()
-                try:
-                    self.app.selected_object.setCost(cur_cost_id,
-                                                     float(value))
-                except ValueError as error:
-                    print(error.message)
-                    is_valid = False
-            elif property_name == "Blocking":
-                self.app.selected_object.setBlocking(value)
-            elif property_name == "Rotation":
-                try:
-                    self.app.selected_object.setRotation(int(value))
-                except ValueError as error:
-                    print(error.message)
-                    is_valid = False
-            elif property_name == "StackPosition":
-                try:
-                    visual = self.app.selected_object.get2dGfxVisual()
-                    visual.setStackPosition(int(value))
-                except ValueError as error:
-                    print(error.message)
-                    is_valid = False
-            if is_valid:
-                map_name = self.app.current_map.name
-                if map_name not in self.app.changed_maps:
-                    self.app.changed_maps.append(map_name)
+                return False
+            return True
+        if section != "Instance":
+            return False
+        is_valid = True
+        if property_name == "Identifier":
+            self.app.editor.set_instance_id(instance, value)
+        elif property_name == "CostId":
+            cur_cost = instance.getCost()
+            try:
+                instance.setCost(value, cur_cost)
+            except UnicodeEncodeError:
+                print("The CostId has to be an ascii value")
+                is_valid = False
+        elif property_name == "Cost":
+            cur_cost_id = instance.getCostId()
+            try:
+                instance.setCost(cur_cost_id, float(value))
+            except ValueError as error:
+                print(error.message)
+                is_valid = False
+        elif property_name == "Blocking":
+            instance.setBlocking(value)
+        elif property_name == "Rotation":
+            try:
+                instance.setRotation(int(value))
+            except ValueError as error:
+                print(error.message)
+                is_valid = False
+        elif property_name == "StackPosition":
+            try:
+                visual = instance.get2dGfxVisual()
+                visual.setStackPosition(int(value))
+            except ValueError as error:
+                print(error.message)
+                is_valid = False
+        if is_valid and self.app.current_map is not None:
+            map_name = self.app.current_map.name
+            if map_name not in self.app.changed_maps:
+                self.app.changed_maps.append(map_name)
+        return is_valid
+
+    def apply_property_value(self, instance, section, property_name, value):
+        """Changes a property when a property change is undone or redone
+        and updates the property editor on the next frame
+
+        Args:
+
+            instance: The fife.Instance
+
+            section: The section of the property
+
+            property_name: The name of the property
+
+            value: The new value of the property
+        """
+        self.set_property_value(instance, section, property_name, value)
+        self.property_refresh_time = time.time()
+
+    def update_pending_property_editor(self):
+        """Updates the property editor if an update was deferred and is
+        due"""
+        if self.property_refresh_time is None:
+            return
+        if time.time() < self.property_refresh_time:
+            return
+        self.property_refresh_time = None
         self.update_property_editor()
 
     def cb_layer_box_changed(self, args):
@@ -1240,6 +1351,9 @@ class EditorGui(object):
         if not identifier.strip():
             identifier = _("New Entity")
         identifier = self.app.world.create_unique_identifier(identifier)
+        # The instance is managed by the world from now on
+        instance_layer = selected_object.getLocation().getLayer()
+        self.app.editor.unindex_instance(selected_object, instance_layer)
         selected_object.setId(identifier)
         entity_data = {}
         general_name = General.registered_as
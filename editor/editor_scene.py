@@ -38,6 +38,7 @@ class EditorListener(GameSceneListener, fife.IKeyListener):
         fife.IKeyListener.__init__(self)
         self.callbacks = {}
         self.callbacks["mouse_pressed"] = []
+        self.callbacks["mouse_released"] = []
         self.callbacks["mouse_dragged"] = []
         self.callbacks["mouse_moved"] = []
         self.callbacks["key_pressed"] = []
@@ -86,6 +87,17 @@ class EditorListener(GameSceneListener, fife.IKeyListener):
 
         self.old_mouse_pos = fife.DoublePoint(event.getX(), event.getY())
 
+    def mouseReleased(self, event):  # pylint: disable=C0103,W0221
+        """Called when a mouse button was released.
+
+        Args:
+            event: The mouse event
+        """
+        for callback_data in self.callbacks["mouse_released"]:
+            func = callback_data["func"]
+            click_point = fife.ScreenPoint(event.getX(), event.getY())
+            func(click_point, event.getButton())
+
     def mouseDragged(self, event):  # pylint: disable=C0103,W0221
         """Called when the mouse is moved while a button is being pressed.
 
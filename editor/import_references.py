@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains the index of the object files that are used by maps
+
+.. module:: import_references
+    :synopsis: Contains the index of the object files that are used by maps
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+from collections import Counter
+
+
+class ImportReferenceIndex(object):
+
+    """Counts how many instances of each map use objects of each file. The
+    counts can be looked up by map and by file."""
+
+    def __init__(self):
+        self.maps = {}
+        self.files = {}
+
+    def increase(self, filename, map_name, count=1):
+        """Increases the reference count of a file on a map
+
+        Args:
+
+            filename: The path to the object file
+
+            map_name: The name of the map
+
+            count: By how much the count is increased
+        """
+        self.maps.setdefault(map_name, Counter())[filename] += count
+        self.files.setdefault(filename, Counter())[map_name] += count
+
+    def decrease(self, filename, map_name, count=1):
+        """Decreases the reference count of a file on a map. The file is
+        removed from the map when its count drops to zero.
+
+        Args:
+
+            filename: The path to the object file
+
+            map_name: The name of the map
+
+            count: By how much the count is decreased
+        """
+        files = self.maps.get(map_name)
+        if files is None or filename not in files:
+            return
+        files[filename] -= count
+        maps = self.files[filename]
+        maps[map_name] -= count
+        if files[filename] <= 0:
+            del files[filename]
+            del maps[map_name]
+            if not maps:
+                del self.files[filename]
+
+    def rebuild_map(self, map_name, counts):
+        """Replaces the reference counts of a map
+
+        Args:
+
+            map_name: The name of the map
+
+            counts: A mapping of the paths to the object files to the number
+            of instances on the map that use objects of the file
+        """
+        self.remove_map(map_name)
+        for filename, count in counts.items():
+            if count > 0:
+                self.increase(filename, map_name, count)
+
+    def remove_map(self, map_name):
+        """Removes all reference counts of a map
+
+        Args:
+
+            map_name: The name of the map
+        """
+        files = self.maps.pop(map_name, None)
+        if files is None:
+            return
+        for filename in files:
+            maps = self.files[filename]
+            del maps[map_name]
+            if not maps:
+                del self.files[filename]
+
+    def get_files(self, map_name):
+        """Returns a list of the object files that are used by a map
+
+        Args:
+
+            map_name: The name of the map
+        """
+        return list(self.maps.get(map_name, {}).keys())
+
+    def get_maps(self, filename):
+        """Returns a list of the maps that use objects of a file
+
+        Args:
+
+            filename: The path to the object file
+        """
+        return list(self.files.get(filename, {}).keys())
+
+    def clear(self):
+        """Removes all reference counts"""
+        self.maps = {}
+        self.files = {}
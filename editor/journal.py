@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains the journal that keeps unsaved changes of maps on disk
+
+.. module:: journal
+    :synopsis: Contains the journal that keeps unsaved changes of maps on disk
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+from queue import Queue, Empty
+import os
+import pickle
+import struct
+import threading
+
+from .undo import CompoundAction, UndoableAction
+
+JOURNAL_EXTENSION = ".journal"
+RECORD_HEADER = struct.Struct(">I")
+
+DONE = "do"
+UNDONE = "undo"
+REDONE = "redo"
+
+
+def read_journal(path):
+    """Reads the entries of a journal file. Reading stops at the first
+    incomplete or damaged record, which is what a crash during a write
+    leaves behind.
+
+    Args:
+
+        path: The path to the journal file
+
+    Returns: A tuple of a list of the entries, empty if the file does not
+    exist, and the length of the valid part of the file
+    """
+    entries = []
+    end = 0
+    try:
+        journal_file = open(path, "rb")
+    except (IOError, OSError):
+        return entries, end
+    with journal_file:
+        while True:
+            header = journal_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            length, = RECORD_HEADER.unpack(header)
+            data = journal_file.read(length)
+            if len(data) < length:
+                break
+            try:
+                entries.append(pickle.loads(data))
+            except Exception:  # pylint: disable=broad-except
+                break
+            end = journal_file.tell()
+    return entries, end
+
+
+class JournalWriter(object):
+
+    """Appends entries to journal files on a background thread. All entries
+    that were queued while the thread was writing are written together and
+    each changed file is synced once for them (group commit)."""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.files = {}
+        self.thread = None
+
+    def put(self, operation):
+        """Queues an operation for the background thread
+
+        Args:
+
+            operation: A tuple with the name of the operation and its
+            arguments
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                                           name="JournalWriter")
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(operation)
+
+    def append(self, path, entry):
+        """Queues an entry to be appended to a journal file
+
+        Args:
+
+            path: The path to the journal file
+
+            entry: The entry, has to be picklable
+        """
+        self.put(("append", path, entry))
+
+    def remove(self, path):
+        """Queues the removal of a journal file
+
+        Args:
+
+            path: The path to the journal file
+        """
+        self.put(("remove", path))
+
+    def flush(self):
+        """Waits until all queued operations are done"""
+        self.queue.join()
+
+    def close(self):
+        """Writes the queued entries and stops the background thread"""
+        thread = self.thread
+        if thread is None:
+            return
+        self.put(("stop",))
+        thread.join()
+        self.thread = None
+
+    def run(self):
+        """Writes the queued entries. This is the function of the background
+        thread."""
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                stopped = self.write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stopped:
+                return
+
+    def write_batch(self, batch):
+        """Performs a batch of operations and syncs the changed files
+
+        Args:
+
+            batch: A list of operations
+
+        Returns: True if the batch contained the stop operation
+        """
+        changed = set()
+        stopped = False
+        for operation in batch:
+            try:
+                if operation[0] == "append":
+                    _, path, entry = operation
+                    journal_file = self.files.get(path)
+                    if journal_file is None:
+                        journal_file = self.files[path] = open(path, "ab")
+                    data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+                    journal_file.write(RECORD_HEADER.pack(len(data)))
+                    journal_file.write(data)
+                    changed.add(path)
+                elif operation[0] == "remove":
+                    _, path = operation
+                    journal_file = self.files.pop(path, None)
+                    if journal_file is not None:
+                        journal_file.close()
+                    changed.discard(path)
+                    if os.path.exists(path):
+                        os.remove(path)
+                elif operation[0] == "stop":
+                    stopped = True
+            except (IOError, OSError, pickle.PicklingError) as error:
+                print(error)
+        for path in changed:
+            journal_file = self.files[path]
+            try:
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            except (IOError, OSError) as error:
+                print(error)
+        if stopped:
+            for journal_file in self.files.values():
+                journal_file.close()
+            self.files = {}
+        return stopped
+
+
+class UnrecordedAction(UndoableAction):
+
+    """Takes the place of an action that could not be written to the
+    journal, so that the undo and redo entries after it still match"""
+
+    def __init__(self, description, map_name):
+        UndoableAction.__init__(self, description)
+        self.map_name = map_name
+
+    def get_map_name(self):
+        """Returns the name of the map the journal belongs to"""
+        return self.map_name
+
+    def redo(self):
+        """Does nothing"""
+
+    def undo(self):
+        """Does nothing"""
+
+
+class UndoJournal(object):
+
+    """Writes the actions of an UndoManager to a journal file for each map,
+    so that unsaved changes can be restored after a crash. The actions are
+    only converted to records on the calling thread, writing happens on the
+    background thread of a JournalWriter."""
+
+    def __init__(self, editor, get_path):
+        """Constructor
+
+        Args:
+
+            editor: The editor the actions belong to
+
+            get_path: A function that is called with the name of a map and
+            returns the path to its journal file, or None if the map has no
+            file yet
+        """
+        self.editor = editor
+        self.get_path = get_path
+        self.writer = JournalWriter()
+        self.paths = {}
+
+    def get_map_name(self, action):
+        """Returns the name of the map an action changes, or None if it
+        changes none or more than one. The children of compound actions that
+        change no map are ignored.
+
+        Args:
+
+            action: The action
+        """
+        if isinstance(action, CompoundAction):
+            map_names = set(self.get_map_name(child)
+                            for child in action.actions)
+            map_names.discard(None)
+            if len(map_names) != 1:
+                return None
+            return map_names.pop()
+        get_map_name = getattr(action, "get_map_name", None)
+        if get_map_name is None:
+            return None
+        return get_map_name()
+
+    def get_journal_path(self, map_name):
+        """Returns the path to the journal file of a map
+
+        Args:
+
+            map_name: The name of the map
+        """
+        path = self.paths.get(map_name)
+        if path is None:
+            path = self.get_path(map_name)
+            if path is not None:
+                self.paths[map_name] = path
+        return path
+
+    def write(self, kind, action):
+        """Appends an entry to the journal of the map of an action. Each
+        entry carries the record of the action in the state after the
+        change, so that actions that were done before the journal started,
+        like before the map was saved, can still be undone and redone when
+        the journal is replayed.
+
+        Args:
+
+            kind: DONE, UNDONE or REDONE
+
+            action: The action
+        """
+        map_name = self.get_map_name(action)
+        if map_name is None:
+            return
+        path = self.get_journal_path(map_name)
+        if path is None:
+            return
+        record = action.get_record()
+        if record is None:
+            self.writer.append(path, (kind, None, action.description))
+        else:
+            self.writer.append(path, (kind, type(action), record))
+
+    def action_done(self, action):
+        """Called by the UndoManager when an action was added
+
+        Args:
+
+            action: The action
+        """
+        self.write(DONE, action)
+
+    def action_undone(self, action):
+        """Called by the UndoManager when an action was undone
+
+        Args:
+
+            action: The action
+        """
+        self.write(UNDONE, action)
+
+    def action_redone(self, action):
+        """Called by the UndoManager when an action was redone
+
+        Args:
+
+            action: The action
+        """
+        self.write(REDONE, action)
+
+    def read(self, map_name):
+        """Returns the entries of the journal of a map. A damaged record at
+        the end of the file is cut off, so that the entries that are
+        appended later can be read again.
+
+        Args:
+
+            map_name: The name of the map
+        """
+        path = self.get_path(map_name)
+        if path is None:
+            return []
+        self.writer.flush()
+        entries, end = read_journal(path)
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > end:
+                with open(path, "r+b") as journal_file:
+                    journal_file.truncate(end)
+        except (IOError, OSError) as error:
+            print(error)
+        return entries
+
+    def replay(self, map_name, entries):
+        """Applies the entries of a journal to its map. The map has to be
+        in the state it was last saved in. Later actions on the map are
+        appended to the same journal.
+
+        Args:
+
+            map_name: The name of the map
+
+            entries: The entries of the journal
+
+        Returns: A list of the actions that are done afterwards, oldest
+        first
+        """
+        self.get_journal_path(map_name)
+        undo_actions = []
+        redo_actions = []
+        for entry in entries:
+            kind, action_type, record = entry
+            try:
+                if kind == DONE:
+                    action = self.restore_action(map_name, action_type,
+                                                 record)
+                    action.redo()
+                    undo_actions.append(action)
+                    redo_actions = []
+                elif kind == UNDONE:
+                    if undo_actions:
+                        action = undo_actions.pop()
+                    else:
+                        # The action was done before the journal started
+                        action = self.restore_action(map_name, action_type,
+                                                     record)
+                    action.undo()
+                    redo_actions.append(action)
+                elif kind == REDONE:
+                    if redo_actions:
+                        action = redo_actions.pop()
+                    else:
+                        action = self.restore_action(map_name, action_type,
+                                                     record)
+                    action.redo()
+                    undo_actions.append(action)
+            except Exception as error:  # pylint: disable=broad-except
+                print(error)
+                break
+        return undo_actions
+
+    def restore_action(self, map_name, action_type, record):
+        """Recreates an action from the data of a journal entry
+
+        Args:
+
+            map_name: The name of the map of the journal
+
+            action_type: The type of the action, None if the action had no
+            record
+
+            record: The record of the action, or its description if it had
+            no record
+        """
+        if action_type is None:
+            return UnrecordedAction(record, map_name)
+        return action_type.from_record(record, self.editor)
+
+    def discard(self, map_name):
+        """Removes the journal of a map
+
+        Args:
+
+            map_name: The name of the map
+        """
+        path = self.paths.pop(map_name, None)
+        if path is None:
+            path = self.get_path(map_name)
+        if path is not None:
+            self.writer.remove(path)
+
+    def discard_all(self):
+        """Removes the journals that were written to"""
+        for path in self.paths.values():
+            self.writer.remove(path)
+        self.paths = {}
+
+    def close(self):
+        """Writes the queued entries and stops the background thread"""
+        self.writer.close()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains caches and records for parsed object and animation definitions
+
+.. module:: object_cache
+    :synopsis: Contains caches and records for parsed object and animation
+    definitions
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+from collections import namedtuple
+import os
+import pickle
+import threading
+try:
+    from sys import intern
+except ImportError:
+    pass
+
+# Increase this when the format of the stored definitions changes
+CACHE_VERSION = 4
+OBJECT_CACHE_FILE = "objects.cache"
+
+
+def intern_path(path):
+    """Returns the absolute path as an interned string, so that equal paths
+    share the same string object.
+
+    Args:
+
+        path: The path to intern
+    """
+    return intern(str(os.path.abspath(path)))
+
+
+class ThumbnailSource(namedtuple("ThumbnailSource",
+                                 ["directory", "filename", "area"])):
+
+    """The image that represents an object in the palette. The directory is
+    interned and shared between all objects of the same directory.
+
+    directory: The directory of the image
+
+    filename: The name of the image file
+
+    area: A tuple with the x position, y position, width and height of the
+    area of the object in the image, or None if the whole image is used.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_path(cls, path, area=None):
+        """Creates the record for an image
+
+        Args:
+
+            path: The path to the image
+
+            area: The area of the object in the image
+        """
+        directory, filename = os.path.split(os.path.abspath(path))
+        return cls(intern(str(directory)), intern(str(filename)), area)
+
+    @property
+    def path(self):
+        """The absolute path to the image"""
+        return os.path.join(self.directory, self.filename)
+
+
+class ObjectPreview(namedtuple("ObjectPreview",
+                               ["identifier", "static", "blocking",
+                                "directions", "thumbnail"])):
+
+    """The parts of an object definition that are needed to show the object
+    in the palette
+
+    identifier: The identifier of the object
+
+    static: Whether the object is static
+
+    blocking: Whether the object is blocking
+
+    directions: A sorted tuple with the directions of the object or of its
+    first action
+
+    thumbnail: The ThumbnailSource of the object
+    """
+
+    __slots__ = ()
+
+
+def get_file_stamp(filename):
+    """Returns a value that changes when the file is modified
+
+    Args:
+
+        filename: The path to the file
+    """
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+class ObjectDefinitionCache(object):
+
+    """Stores the definitions parsed from object files on disk, so that
+    unchanged files do not have to be parsed again."""
+
+    def __init__(self, cache_file=None):
+        """Constructor
+
+        Args:
+
+            cache_file: The file the cache is stored in. If None the cache
+            will only be kept in memory.
+        """
+        self.cache_file = cache_file
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        if cache_file is not None:
+            self.load()
+
+    def load(self):
+        """Loads the cache from the cache file. An outdated or unreadable
+        cache file is ignored."""
+        self.entries = {}
+        self.changed = False
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "rb") as cache_file:
+                version, entries = pickle.load(cache_file)
+        except Exception:  # pylint: disable=broad-except
+            return
+        if version == CACHE_VERSION:
+            self.entries = entries
+
+    def save(self):
+        """Writes the cache to the cache file, if anything was changed"""
+        if self.cache_file is None or not self.changed:
+            return
+        cache_dir = os.path.dirname(self.cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with self.lock:
+                data = (CACHE_VERSION, self.entries)
+                with open(self.cache_file, "wb") as cache_file:
+                    pickle.dump(data, cache_file, pickle.HIGHEST_PROTOCOL)
+                self.changed = False
+        except (IOError, OSError) as error:
+            print(error)
+
+    def lookup(self, filename):
+        """Returns the cached definitions of a file
+
+        Args:
+
+            filename: The path to the object file
+
+        Returns:
+
+            The list of definitions, or None if the file was not cached or
+            was modified since it was cached.
+        """
+        filename = os.path.abspath(filename)
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        stamp, definitions = entry
+        try:
+            if get_file_stamp(filename) != stamp:
+                return None
+        except OSError:
+            return None
+        return definitions
+
+    def store(self, filename, definitions):
+        """Stores the definitions of a file
+
+        Args:
+
+            filename: The path to the object file
+
+            definitions: The list of definitions parsed from the file
+        """
+        filename = os.path.abspath(filename)
+        try:
+            stamp = get_file_stamp(filename)
+        except OSError:
+            return
+        with self.lock:
+            self.entries[filename] = (stamp, definitions)
+            self.changed = True
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        with self.lock:
+            self.entries = {}
+            self.changed = True
+
+
+class AnimationCache(object):
+
+    """Keeps parsed animation files in memory, so that animation files that
+    are used by several objects are only parsed once. The directions of
+    animation files, which are all that is read of most of them for the
+    previews, are kept separately."""
+
+    def __init__(self):
+        self.entries = {}
+        self.directions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, filename):
+        """Returns the cached definition of an animation file
+
+        Args:
+
+            filename: The path to the animation file
+
+        Returns:
+
+            The definition of the animation, or None if the file was not
+            cached or was modified since it was cached.
+        """
+        return self.lookup_entry(self.entries, filename)
+
+    def store(self, filename, definition):
+        """Stores the definition of an animation file
+
+        Args:
+
+            filename: The path to the animation file
+
+            definition: The definition parsed from the file
+        """
+        self.store_entry(self.entries, filename, definition)
+
+    def lookup_direction(self, filename):
+        """Returns the cached direction of an animation file
+
+        Args:
+
+            filename: The path to the animation file
+
+        Returns:
+
+            The direction of the animation, or None if the file was not
+            cached or was modified since it was cached.
+        """
+        return self.lookup_entry(self.directions, filename)
+
+    def store_direction(self, filename, direction):
+        """Stores the direction of an animation file
+
+        Args:
+
+            filename: The path to the animation file
+
+            direction: The direction read from the file
+        """
+        self.store_entry(self.directions, filename, direction)
+
+    def lookup_entry(self, entries, filename):
+        """Returns a cached value of a file if the file was not modified
+        since the value was stored and counts the hit or miss
+
+        Args:
+
+            entries: The dictionary the value is stored in
+
+            filename: The path to the file
+        """
+        filename = os.path.abspath(filename)
+        with self.lock:
+            entry = entries.get(filename)
+        if entry is not None:
+            stamp, value = entry
+            try:
+                if get_file_stamp(filename) == stamp:
+                    self.hits += 1
+                    return value
+            except OSError:
+                pass
+        self.misses += 1
+        return None
+
+    def store_entry(self, entries, filename, value):
+        """Stores a value of a file together with the stamp of the file
+
+        Args:
+
+            entries: The dictionary the value is stored in
+
+            filename: The path to the file
+
+            value: The value
+        """
+        filename = os.path.abspath(filename)
+        try:
+            stamp = get_file_stamp(filename)
+        except OSError:
+            return
+        with self.lock:
+            entries[filename] = (stamp, value)
+
+    def get_stats(self):
+        """Returns a tuple with the number of hits and misses"""
+        return self.hits, self.misses
+
+    def clear(self):
+        """Removes all entries from the cache and resets the statistics"""
+        with self.lock:
+            self.entries = {}
+            self.directions = {}
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains the parsers for fife object definition files. The module does
+not use the gui, so that the processes that parse the files only have to
+import it.
+
+.. module:: object_parser
+    :synopsis: Contains the parsers for fife object definition files
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import next
+from io import StringIO
+import os
+
+from lxml import etree
+
+from .object_cache import (AnimationCache, ObjectPreview, ThumbnailSource,
+                           intern_path)
+from .thumbnail_atlas import get_thumbnail_source
+
+ANIMATION_CACHE = AnimationCache()
+
+
+def parse_file(filename, preview=False):
+    """Generator that parse an fife object definition file and yields the
+    objects.
+
+        Args:
+
+            filename: The path to the object file.
+
+            preview: If True only the preview records of the objects are
+            parsed, see parse_object_preview.
+    """
+    root_path = os.path.dirname(filename)
+    parse_func = parse_object_preview if preview else parse_object
+    try:
+        atlas_def = {"images": {}}
+        atlas_source = None
+        context = etree.iterparse(filename, events=("start", "end"))
+        for event, element in context:
+            if event == "start":
+                if element.getparent() is None:
+                    assert(element.tag == "assets")
+                elif element.tag == "atlas":
+                    atlas_source = element.attrib["source"]
+                continue
+            if element.tag == "subimage":
+                image_name, record = parse_subimage(element, atlas_source)
+                atlas_def["images"][image_name] = record
+            elif element.tag == "object":
+                if element.getparent().tag != "assets":
+                    continue
+                yield parse_func(element, root_path, atlas_def)
+            elif element.tag != "atlas":
+                continue
+            # Free the elements that were already processed
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+    except etree.XMLSyntaxError as error:
+        # TODO: Should be obsolete with the fife xml update
+
+        assert False
+        doc = file(filename, "r")
+        line_no = error.position[0] - 2
+        lines = doc.readlines()
+        first_doc = StringIO(u"".join(lines[:line_no]))
+        tree = etree.parse(first_doc)
+        root = tree.getroot()
+        proc_instr = root.getprevious()
+        file_type = proc_instr.text.split("=")[1].replace('"', '').lower()
+        if not file_type == "atlas":
+            raise RuntimeError("Unexpected file format '%s'" % (filename))
+        atlas_def = parse_atlas(root, root_path)
+        second_doc = lines[line_no + 1:]
+        second_doc.insert(0, "<namespaces>\n")
+        second_doc.append("</namespaces>\n")
+        second_doc = StringIO(u"".join(second_doc))
+        tree = etree.parse(second_doc)
+        object_defs = tree.getroot().findall("object")
+        for obj in object_defs:
+            yield parse_object(obj, root_path, atlas_def)
+
+
+def parse_file_definitions(filename):
+    """Parses an fife object definition file and returns a list of the
+    preview records of the objects. Used as the task of the parser processes.
+
+        Args:
+
+            filename: The path to the object file.
+
+        Returns: A tuple with the list of objects and a tuple with the
+        number of hits and misses of the animation cache while parsing.
+    """
+    old_hits, old_misses = ANIMATION_CACHE.get_stats()
+    definitions = list(parse_file(filename, preview=True))
+    hits, misses = ANIMATION_CACHE.get_stats()
+    return definitions, (hits - old_hits, misses - old_misses)
+
+
+def parse_atlas(element, root_path):  # pylint: disable=unused-argument
+    """Parse an atlas definition
+
+        Args:
+
+            element: The etree element that contains the definition
+
+            root_path: The path of the object file the element is in
+
+        Returns: A dictionary with images and their positions in an atlas
+    """
+    atlas_def = {}
+
+    atlas_def["images"] = {}
+    atlas_source = element.attrib["source"]
+    images = element.findall("subimage")
+    for image in images:
+        image_name, record = parse_subimage(image, atlas_source)
+        atlas_def["images"][image_name] = record
+
+    return atlas_def
+
+
+def parse_subimage(element, atlas_source):
+    """Parse the definition of an image in an atlas
+
+        Args:
+
+            element: The etree element that contains the definition
+
+            atlas_source: The path of the atlas image
+
+        Returns: A tuple with the name of the image and a tuple with
+        the path of the atlas image and the xpos, ypos, width and height
+        of the image in the atlas.
+    """
+    attribs = element.attrib
+    return attribs["id"], (atlas_source,
+                           attribs["xpos"], attribs["ypos"],
+                           attribs["width"], attribs["height"])
+
+
+def parse_object(obj, root_path, atlas_def=None):
+    """Parse an object definition
+
+        Args:
+
+            obj: The etree element containing the definition
+
+            root_path: The path of the object file the element is in
+
+            atlas_def: A dictionary with images and their positions in an atlas
+    """
+    obj_def = {}
+
+    obj_def["object"] = dict(obj.attrib)
+    if atlas_def:
+        image_sources = atlas_def["images"]
+    else:
+        image_sources = {}
+    if int(obj.attrib["static"]) == 0:
+        obj_def["actions"] = parse_actions(obj.findall("action"), root_path)
+    elif int(obj.attrib["static"]) == 1:
+        images = obj.findall("image")
+        dir_defs = obj_def["directions"] = {}
+        for image in images:
+            attrib = dict(image.attrib)
+            source = attrib["source"]
+            image_def = attrib
+            if source in image_sources:
+                (image_def["source"], image_def["xpos"], image_def["ypos"],
+                 image_def["width"], image_def["height"]) = \
+                    image_sources[source]
+                image_def["type"] = "atlas"
+            else:
+                image_def["type"] = "image"
+            source = os.path.join(root_path, image_def["source"])
+            image_def["source"] = intern_path(source)
+            direction = int(image_def["direction"])
+            dir_defs[direction] = image_def
+
+    else:
+        raise RuntimeError("Don't know how to handle '%s'" % (obj[0].tag))
+    return obj_def
+
+
+def parse_object_preview(obj, root_path, atlas_def=None):
+    """Parse the parts of an object definition that are needed to show the
+    object in the palette. Of animated objects only the first action is
+    looked at and only the lowest direction of it is parsed completely.
+
+        Args:
+
+            obj: The etree element containing the definition
+
+            root_path: The path of the object file the element is in
+
+            atlas_def: A dictionary with images and their positions in an atlas
+
+        Returns: An ObjectPreview record
+    """
+    if int(obj.attrib["static"]) == 0:
+        action = obj.find("action")
+        animations = action.findall("animation")
+        if "atlas" in animations[0].attrib:
+            action_def = parse_animations(animations, root_path)
+            dirs = sorted(action_def["directions"].keys())
+        else:
+            animation_dirs = {}
+            for animation in animations:
+                direction = get_animation_direction(animation, root_path)
+                animation_dirs[direction] = animation
+            dirs = sorted(animation_dirs.keys())
+            ani_def = parse_animation(animation_dirs[dirs[0]], root_path)
+            action_def = {"type": "multi", "directions": {dirs[0]: ani_def}}
+        obj_def = {"object": dict(obj.attrib),
+                   "actions": {action.attrib["id"]: action_def}}
+    else:
+        obj_def = parse_object(obj, root_path, atlas_def)
+        dirs = sorted(obj_def["directions"].keys())
+
+    source, area = get_thumbnail_source(obj_def)
+    return ObjectPreview(obj.attrib["id"], int(obj.attrib["static"]) == 1,
+                         int(obj.attrib.get("blocking", 0)) == 1,
+                         tuple(dirs), ThumbnailSource.from_path(source, area))
+
+
+def parse_actions(actions, root_path):
+    """Parse action definitions
+
+        Args:
+
+            actions: A list of etree elements containg action definitons
+
+            root_path: The path of the object file the elements are in
+    """
+    action_dict = {}
+    for action in actions:
+
+        animations = parse_animations(action.findall("animation"), root_path)
+        action_dict[action.attrib["id"]] = animations
+
+    return action_dict
+
+
+def parse_animations(animations, root_path):
+    """Parse animation definitions
+
+        Args:
+
+            animations: A list of etree elements containg animation definitons
+
+            root_path: The path of the object file the elements are in
+    """
+    ani_dict = {}
+
+    if "atlas" in animations[0].attrib:
+        ani_dict["type"] = "single"
+        animation = animations[0]
+        ani_dict.update(parse_animation_atlas(animation, root_path))
+    else:
+        ani_dict["type"] = "multi"
+        ani_dict["directions"] = {}
+        for animation in animations:
+            ani_def = parse_animation(animation, root_path)
+            direction = int(ani_def["direction"])
+            ani_dict["directions"][direction] = ani_def
+
+    return ani_dict
+
+
+def parse_animation(animation, root_path):
+    """Parse an animation definition
+
+        Args:
+
+            animation: An etree element containing the definiton
+
+            root_path: The path of the object file the element is in
+    """
+    ani_dict = {}
+
+    if "source" in animation.attrib:
+        animation_file = animation.attrib["source"]
+        ani_file = os.path.join(root_path, animation_file)
+        cached_dict = ANIMATION_CACHE.lookup(ani_file)
+        if cached_dict is not None:
+            return cached_dict
+        ani_path = os.path.dirname(ani_file)
+        ani_doc = etree.parse(ani_file)
+        root = ani_doc.getroot()
+        ani_dict["delay"] = root.attrib["delay"]
+        ani_dict.update(parse_animation(root, ani_path))
+        ANIMATION_CACHE.store(ani_file, ani_dict)
+    else:
+        frames = []
+        for frame in animation.findall("frame"):
+            source = os.path.join(root_path, frame.attrib["source"])
+            frames.append(intern_path(source))
+        ani_dict["direction"] = animation.attrib["id"].split(":")[2]
+        ani_dict["frames"] = frames
+        ani_dict["x_offset"] = animation.attrib["x_offset"]
+        ani_dict["y_offset"] = animation.attrib["y_offset"]
+
+    return ani_dict
+
+
+def get_animation_direction(animation, root_path):
+    """Returns the direction of an animation without parsing its frames
+
+        Args:
+
+            animation: An etree element containing the definiton
+
+            root_path: The path of the object file the element is in
+    """
+    if "source" in animation.attrib:
+        ani_file = os.path.join(root_path, animation.attrib["source"])
+        direction = ANIMATION_CACHE.lookup_direction(ani_file)
+        if direction is not None:
+            return direction
+        with open(ani_file, "rb") as ani_doc:
+            _, animation = next(etree.iterparse(ani_doc, events=("start",)))
+        direction = int(animation.attrib["id"].split(":")[2])
+        ANIMATION_CACHE.store_direction(ani_file, direction)
+        return direction
+    return int(animation.attrib["id"].split(":")[2])
+
+
+def parse_animation_atlas(animation, root_path):
+    """Parse an animation definition that uses an atlas
+
+        Args:
+
+            animation: An etree element containing the definiton
+
+            root_path: The path of the object file the element is in
+    """
+    ani_dict = {}
+
+    ani_dict["atlas"] = {}
+    image = os.path.join(root_path, animation.attrib["atlas"])
+    ani_dict["atlas"]["image"] = intern_path(image)
+    ani_dict["atlas"]["width"] = animation.attrib["width"]
+    ani_dict["atlas"]["height"] = animation.attrib["height"]
+    ani_dict["directions"] = {}
+    for direction in animation.findall("direction"):
+        action_dir = int(direction.attrib["dir"])
+        dir_data = ani_dict["directions"][action_dir] = {}
+        dir_data["delay"] = direction.attrib["delay"]
+        dir_data["frames"] = direction.attrib["frames"]
+
+    return ani_dict
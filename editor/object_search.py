@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains the search index of the object palette
+
+.. module:: object_search
+    :synopsis: Contains the search index of the object palette
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+from bisect import bisect_left, insort
+import re
+
+ATTRIBUTES = ("static", "blocking")
+TRUE_VALUES = ("1", "yes", "true")
+WORD_SEPARATORS = re.compile(r"[^0-9a-z]+")
+
+
+def get_trigrams(text):
+    """Returns the set of the trigrams of a text
+
+    Args:
+
+        text: The text
+    """
+    return set(text[index:index + 3] for index in range(len(text) - 2))
+
+
+def split_words(text):
+    """Returns the words of a text, split at anything that is not a letter
+    or a digit
+
+    Args:
+
+        text: The text
+    """
+    return [word for word in WORD_SEPARATORS.split(text) if word]
+
+
+def parse_query(query):
+    """Splits a query into search terms and attribute filters. Attribute
+    filters have the form name:value, like "static:1" or "blocking:no".
+
+    Args:
+
+        query: The query
+
+    Returns: A tuple with a list of the search terms and a dictionary with
+    the filtered attributes and their values.
+    """
+    terms = []
+    attributes = {}
+    for token in query.lower().split():
+        key, separator, value = token.partition(":")
+        if separator and key in ATTRIBUTES:
+            attributes[key] = value in TRUE_VALUES
+        else:
+            terms.append(token)
+    return terms, attributes
+
+
+class ObjectSearchIndex(object):
+
+    """Indexes the names and attributes of objects. Search terms with three
+    or more characters match anywhere in the name and are looked up by
+    trigrams, shorter terms match the start of a word of the name."""
+
+    def __init__(self):
+        self.names = {}
+        self.trigrams = {}
+        self.words = []
+        self.attributes = {}
+
+    def add(self, name, attributes):
+        """Adds an object to the index
+
+        Args:
+
+            name: The name of the object, including the namespace
+
+            attributes: A dictionary with the values of the attributes
+            listed in ATTRIBUTES
+        """
+        if name in self.names:
+            self.remove(name)
+        text = name.lower()
+        self.names[name] = (text, attributes)
+        for trigram in get_trigrams(text):
+            self.trigrams.setdefault(trigram, set()).add(name)
+        for word in set(split_words(text)):
+            insort(self.words, (word, name))
+        for key, value in attributes.items():
+            self.attributes.setdefault((key, bool(value)), set()).add(name)
+
+    def remove(self, name):
+        """Removes an object from the index
+
+        Args:
+
+            name: The name of the object, including the namespace
+        """
+        if name not in self.names:
+            return
+        text, attributes = self.names.pop(name)
+        for trigram in get_trigrams(text):
+            names = self.trigrams[trigram]
+            names.discard(name)
+            if not names:
+                del self.trigrams[trigram]
+        for word in set(split_words(text)):
+            index = bisect_left(self.words, (word, name))
+            del self.words[index]
+        for key, value in attributes.items():
+            self.attributes[(key, bool(value))].discard(name)
+
+    def clear(self):
+        """Removes all objects from the index"""
+        self.names = {}
+        self.trigrams = {}
+        self.words = []
+        self.attributes = {}
+
+    def find_prefix(self, prefix):
+        """Returns the set of the objects that have a word that starts with
+        the prefix
+
+        Args:
+
+            prefix: The prefix
+        """
+        names = set()
+        index = bisect_left(self.words, (prefix,))
+        while index < len(self.words):
+            word, name = self.words[index]
+            if not word.startswith(prefix):
+                break
+            names.add(name)
+            index += 1
+        return names
+
+    def find_term(self, term):
+        """Returns the set of the objects whose name contains a search term
+
+        Args:
+
+            term: The search term
+        """
+        if len(term) < 3:
+            return self.find_prefix(term)
+        postings = []
+        for trigram in get_trigrams(term):
+            names = self.trigrams.get(trigram)
+            if names is None:
+                return set()
+            postings.append(names)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return set(name for name in candidates
+                   if term in self.names[name][0])
+
+    def search(self, query):
+        """Returns the objects that match a query
+
+        Args:
+
+            query: The query, see parse_query
+
+        Returns: The set of the names of the matching objects, or None if
+        the query is empty.
+        """
+        terms, attributes = parse_query(query)
+        if not terms and not attributes:
+            return None
+        results = [self.find_term(term) for term in terms]
+        for key, value in attributes.items():
+            results.append(self.attributes.get((key, value), set()))
+        results.sort(key=len)
+        return results[0].intersection(*results[1:])
+
+    def matches(self, name, query):
+        """Returns whether a single object matches a query
+
+        Args:
+
+            name: The name of the object, including the namespace
+
+            query: The query, see parse_query
+        """
+        if name not in self.names:
+            return False
+        text, obj_attributes = self.names[name]
+        terms, attributes = parse_query(query)
+        for term in terms:
+            if len(term) < 3:
+                words = split_words(text)
+                if not any(word.startswith(term) for word in words):
+                    return False
+            elif term not in text:
+                return False
+        for key, value in attributes.items():
+            if bool(obj_attributes.get(key)) != value:
+                return False
+        return True
@@ -23,14 +23,16 @@ from __future__ import division
 
 from future import standard_library
 standard_library.install_aliases()
-from builtins import next
-from past.utils import old_div
-from io import StringIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
 from queue import Queue, Empty
+import shutil
+import tempfile
+import time
 import _thread
 
-from lxml import etree
 import PyCEGUI
 from fife import fife
 
@@ -39,223 +41,51 @@ import PyCEGUIOpenGLRenderer  # @UnusedImport
 # pylint: enable=unused-import
 
 from .toolbarpage import ToolbarPage
+from .common import get_cache_dir
+from .object_search import ObjectSearchIndex
+from .object_cache import ObjectDefinitionCache, OBJECT_CACHE_FILE
+from .object_parser import parse_file_definitions, ANIMATION_CACHE
+from . import thumbnail_atlas
+from .thumbnail_atlas import ThumbnailAtlas, THUMBNAIL_CACHE_DIR
 from .undo_editor import UndoCreateInstance, UndoRemoveInstance
 
 
-def parse_file(filename):
-    """Generator that parse an fife object definition file and yields the
-    objects.
+def group_objects_by_file(fife_objects):
+    """Groups fife objects by the file they were loaded from
 
         Args:
 
-            filename: The path to the object file.
-    """
-    root_path = os.path.dirname(filename)
-    try:
-        tree = etree.parse(filename)
-        """:type : etree._ElementTree"""
-        root = tree.getroot()
-        """:type : etree._Element"""
-        assert(root.tag == "assets")
-        atlas_def = dict()
-        for element in root.findall("atlas"):
-            atlas_def.update(parse_atlas(element, root_path))
-        for obj in root.findall("object"):
-            assert(isinstance(obj, etree._Element))
-            yield parse_object(obj, root_path, atlas_def)
-
-    except etree.XMLSyntaxError as error:
-        # TODO: Should be obsolete with the fife xml update
-
-        assert False
-        doc = file(filename, "r")
-        line_no = error.position[0] - 2
-        lines = doc.readlines()
-        first_doc = StringIO(u"".join(lines[:line_no]))
-        tree = etree.parse(first_doc)
-        root = tree.getroot()
-        proc_instr = root.getprevious()
-        file_type = proc_instr.text.split("=")[1].replace('"', '').lower()
-        if not file_type == "atlas":
-            raise RuntimeError("Unexpected file format '%s'" % (filename))
-        atlas_def = parse_atlas(root, root_path)
-        second_doc = lines[line_no + 1:]
-        second_doc.insert(0, "<namespaces>\n")
-        second_doc.append("</namespaces>\n")
-        second_doc = StringIO(u"".join(second_doc))
-        tree = etree.parse(second_doc)
-        object_defs = tree.getroot().findall("object")
-        for obj in object_defs:
-            yield parse_object(obj, root_path, atlas_def)
-
-def parse_atlas(element, root_path):  # pylint: disable=unused-argument
-    """Parse an atlas definition
-
-        Args:
-
-            element: The etree element that contains the definition
+            fife_objects: An iterable of fife.Object instances
 
-            root_path: The path of the object file the element is in
-
-        Returns: A dictionary with images and their positions in an atlas
+        Returns: A list of tuples with the filename and the identifiers of
+        the objects loaded from that file.
     """
-    atlas_def = {}
-
-    atlas_def["atlas"] = element
-    atlas_def["images"] = {}
-    images = element.findall("subimage")
-    for image in images:
-        attribs = image.attrib
-        image_name = attribs["id"]
-        atlas_def["images"][image_name] = image
-
-    return atlas_def
+    files = OrderedDict()
+    for fife_object in fife_objects:
+        filename = fife_object.getFilename()
+        if filename not in files:
+            files[filename] = []
+        files[filename].append(fife_object.getId())
+    return list(files.items())
 
 
-def parse_object(obj, root_path, atlas_def=None):
-    """Parse an object definition
+def diff_catalog_snapshots(old_snapshot, new_snapshot):
+    """Compares two catalog snapshots
 
         Args:
 
-            obj: The etree element containing the definition
-
-            root_path: The path of the object file the element is in
-
-            atlas_def: A dictionary with images and their positions in an atlas
-    """
-    obj_def = {}
-
-    obj_def["object"] = dict(obj.attrib)
-    if atlas_def:
-        image_sources = atlas_def["images"]
-    else:
-        image_sources = {}
-    if int(obj.attrib["static"]) == 0:
-        obj_def["actions"] = parse_actions(obj.findall("action"), root_path)
-    elif int(obj.attrib["static"]) == 1:
-        images = obj.findall("image")
-        dir_defs = obj_def["directions"] = {}
-        for image in images:
-            attrib = dict(image.attrib)
-            source = attrib["source"]
-            image_def = attrib
-            if source in image_sources:
-                image_def.update(image_sources[source].attrib)
-                image_def["type"] = "atlas"
-                image_def["source"] = atlas_def["atlas"].attrib["source"]
-            else:
-                image_def["type"] = "image"
-            source = os.path.join(root_path, image_def["source"])
-            image_def["source"] = os.path.abspath(source)
-            direction = int(image_def["direction"])
-            dir_defs[direction] = image_def
-
-    else:
-        raise RuntimeError(_("Don't know how to handle '%s'") % (obj[0].tag))
-    return obj_def
-
-
-def parse_actions(actions, root_path):
-    """Parse action definitions
-
-        Args:
-
-            actions: A list of etree elements containg action definitons
-
-            root_path: The path of the object file the elements are in
-    """
-    action_dict = {}
-    for action in actions:
-
-        animations = parse_animations(action.findall("animation"), root_path)
-        action_dict[action.attrib["id"]] = animations
-
-    return action_dict
-
-
-def parse_animations(animations, root_path):
-    """Parse animation definitions
-
-        Args:
+            old_snapshot: The snapshot the catalog is currently based on
 
-            animations: A list of etree elements containg animation definitons
+            new_snapshot: The current snapshot
 
-            root_path: The path of the object file the elements are in
+        Returns: A tuple with a list of the added and a list of the removed
+        objects. Objects whose file was modified are in both lists.
     """
-    ani_dict = {}
-
-    if "atlas" in animations[0].attrib:
-        ani_dict["type"] = "single"
-        animation = animations[0]
-        ani_dict.update(parse_animation_atlas(animation, root_path))
-    else:
-        ani_dict["type"] = "multi"
-        ani_dict["directions"] = {}
-        for animation in animations:
-            ani_def = parse_animation(animation, root_path)
-            direction = int(ani_def["direction"])
-            ani_dict["directions"][direction] = ani_def
-
-    return ani_dict
-
-
-def parse_animation(animation, root_path):
-    """Parse an animation definition
-
-        Args:
-
-            animation: An etree element containing the definiton
-
-            root_path: The path of the object file the element is in
-    """
-    ani_dict = {}
-
-    if "source" in animation.attrib:
-        animation_file = animation.attrib["source"]
-        ani_file = os.path.join(root_path, animation_file)
-        ani_path = os.path.dirname(ani_file)
-        ani_doc = etree.parse(ani_file)
-        root = ani_doc.getroot()
-        ani_dict["delay"] = root.attrib["delay"]
-        ani_dict.update(parse_animation(root, ani_path))
-    else:
-        frames = []
-        for frame in animation.findall("frame"):
-            source = os.path.join(root_path, frame.attrib["source"])
-            source = os.path.abspath(source)
-            frames.append(source)
-        ani_dict["direction"] = animation.attrib["id"].split(":")[2]
-        ani_dict["frames"] = frames
-        ani_dict["x_offset"] = animation.attrib["x_offset"]
-        ani_dict["y_offset"] = animation.attrib["y_offset"]
-
-    return ani_dict
-
-
-def parse_animation_atlas(animation, root_path):
-    """Parse an animation definition that uses an atlas
-
-        Args:
-
-            animation: An etree element containing the definiton
-
-            root_path: The path of the object file the element is in
-    """
-    ani_dict = {}
-
-    ani_dict["atlas"] = {}
-    image = os.path.join(root_path, animation.attrib["atlas"])
-    ani_dict["atlas"]["image"] = os.path.abspath(image)
-    ani_dict["atlas"]["width"] = animation.attrib["width"]
-    ani_dict["atlas"]["height"] = animation.attrib["height"]
-    ani_dict["directions"] = {}
-    for direction in animation.findall("direction"):
-        action_dir = int(direction.attrib["dir"])
-        dir_data = ani_dict["directions"][action_dir] = {}
-        dir_data["delay"] = direction.attrib["delay"]
-        dir_data["frames"] = direction.attrib["frames"]
-
-    return ani_dict
+    added = [key for key, value in new_snapshot.items()
+             if old_snapshot.get(key) != value]
+    removed = [key for key, value in old_snapshot.items()
+               if new_snapshot.get(key) != value]
+    return added, removed
 
 
 class ObjectToolbar(ToolbarPage):
@@ -263,6 +93,12 @@ class ObjectToolbar(ToolbarPage):
     """A toolbar for displaying and placing static objects on a map"""
     DEFAULT_ALPHA = 0.75
     HIGHLIGHT_ALPHA = 1.0
+    DEFAULT_FRAME_BUDGET = 8.0
+    MIN_FRAME_BUDGET = 1.0
+    TARGET_FRAME_TIME = 1000.0 / 30
+    ROW_HEIGHT = 64
+    OVERSCAN_ROWS = 4
+    UPDATE_TASK = "ObjectToolbar.update_objects"
 
     def __init__(self, app):
 
@@ -285,6 +121,18 @@ class ObjectToolbar(ToolbarPage):
         label.setWidth(width)
         label.setXPosition(x_pos)
         label.setProperty("HorzFormatting", "LeftAligned")
+        search_box = self.gui.createChild("TaharezLook/Editbox",
+                                          "ObjectsSearch")
+        y_pos.d_scale = y_pos.d_scale + 0.045
+        search_box.setXPosition(x_pos)
+        search_box.setYPosition(y_pos)
+        search_box.setWidth(width)
+        search_box.setHeight(PyCEGUI.UDim(0.04, 0))
+        search_box.setTooltipText(_("Search objects, filter with static:1 "
+                                    "or blocking:0"))
+        search_box.subscribeEvent(PyCEGUI.Editbox.EventTextChanged,
+                                  self.cb_search_changed)
+        self.search_box = search_box
         items_panel = self.gui.createChild("TaharezLook/ScrollablePane",
                                            "Items_panel")
         y_pos.d_scale = y_pos.d_scale + 0.045
@@ -294,17 +142,37 @@ class ObjectToolbar(ToolbarPage):
         size.d_height.d_scale = size.d_height.d_scale - y_pos.d_scale
         size.d_width.d_offset = size.d_width.d_offset - x_adjust
         items_panel.setSize(size)
+        items_panel.setContentPaneAutoSized(False)
+        items_panel.subscribeEvent(
+            PyCEGUI.ScrollablePane.EventContentPaneScrolled,
+            self.cb_palette_scrolled)
+        items_panel.subscribeEvent(PyCEGUI.Window.EventSized,
+                                   self.cb_palette_sized)
         self.items_panel = items_panel
-        self.items = None
+        self.entries = []
+        self.palette_entries = self.entries
+        self.search_index = ObjectSearchIndex()
+        self.search_query = ""
+        self.entry_defs = {}
+        self.defined_images = set()
+        self.free_windows = []
+        self.window_count = 0
+        self.palette_changed = False
+        self.thumbnail_atlas = None
+        self.thumbnails_added = 0
         self.have_objects_changed = False
         self.app.add_map_switch_callback(self.cb_map_changed)
         self.last_mouse_pos = None
         self.last_instance = None
+        self.is_painting = False
+        self.painted_cells = set()
         mode = self.app.current_mode
         mode.listener.add_callback("mouse_pressed",
-                                   self.cb_map_clicked)
+                                   self.cb_map_pressed)
         mode.listener.add_callback("mouse_dragged",
-                                   self.cb_map_clicked)
+                                   self.cb_map_dragged)
+        mode.listener.add_callback("mouse_released",
+                                   self.cb_map_released)
         mode.listener.add_callback("mouse_moved",
                                    self.cb_map_moved)
         mode.listener.add_callback("key_pressed",
@@ -312,8 +180,14 @@ class ObjectToolbar(ToolbarPage):
         self.app.add_project_clear_callback(self.cb_project_closed)
         self.app.add_objects_imported_callback(self.cb_objects_imported)
         self.objects = Queue()
+        self.catalog_snapshot = OrderedDict()
         self.images_lock = _thread.allocate_lock()
         self.namespaces_lock = _thread.allocate_lock()
+        self.object_cache = ObjectDefinitionCache()
+        self.parser_executor = None
+        self.max_frame_budget = self.DEFAULT_FRAME_BUDGET
+        self.frame_budget = self.DEFAULT_FRAME_BUDGET
+        self.last_update_time = None
 
     def image_clicked(self, args):
         """Called when the user clicked on an image
@@ -322,192 +196,551 @@ class ObjectToolbar(ToolbarPage):
 
                 args: The args of the event
         """
-        self.images_lock.acquire()
-        identifier = args.window.getName()
-        image = self.images[identifier]
-        obj_data = image.user_data
-        if identifier not in self.images:
+        if args.window.user_data is None:
             return
+        namespace, name = args.window.user_data
+        identifier = ".".join((namespace, name))
+        self.images_lock.acquire()
         if self.selected_object[0] is not None:
             old_identifier = ".".join(self.selected_object)
-            self.images[old_identifier].setAlpha(self.DEFAULT_ALPHA)
-        self.images[identifier].setAlpha(self.HIGHLIGHT_ALPHA)
-        self.selected_object = obj_data
+            if old_identifier in self.images:
+                self.images[old_identifier].setAlpha(self.DEFAULT_ALPHA)
+        args.window.setAlpha(self.HIGHLIGHT_ALPHA)
+        self.selected_object = [namespace, name]
         self.cur_rotation = self.image_directions[identifier][0]
         self.images_lock.release()
 
     def update_contents(self):
         """Update the contents of the toolbar page"""
         if self.have_objects_changed and self.is_active:
-            _thread.start_new(self.update_objects_threaded, ())
+            self.have_objects_changed = False
+            self.app.scheduler.submit(self.UPDATE_TASK,
+                                      self.update_objects_threaded,
+                                      callback=self.cb_objects_updated)
         elif self.is_active:
-            self.process_object()
+            self.process_objects()
         ToolbarPage.update_contents(self)
 
-    def update_objects_threaded(self):
-        """Update the contents of the toolbar page"""
+    def process_objects(self):
+        """Processes objects from the Queue until the time budget of the
+        frame is used up"""
+        now = time.time()
+        if self.last_update_time is not None:
+            self.adapt_frame_budget((now - self.last_update_time) * 1000.0)
+        self.last_update_time = now
+        deadline = now + self.frame_budget / 1000.0
+        while self.process_object():
+            if time.time() >= deadline:
+                break
+        if self.palette_changed:
+            self.update_palette()
+        self.flush_thumbnail_atlas()
+
+    def adapt_frame_budget(self, frame_time):
+        """Adapts the time budget for processing objects to the measured
+        frame time
+
+            Args:
+
+                frame_time: The time the last frame took in milliseconds
+        """
+        if frame_time > self.TARGET_FRAME_TIME:
+            self.frame_budget = max(self.frame_budget * 0.75,
+                                    self.MIN_FRAME_BUDGET)
+        elif frame_time < self.TARGET_FRAME_TIME * 0.8:
+            self.frame_budget = min(self.frame_budget + 1.0,
+                                    self.max_frame_budget)
+
+    def update_objects_threaded(self, token):
+        """Update the contents of the toolbar page. This is run by the
+        scheduler of the application.
+
+            Args:
+
+                token: The CancellationToken of the task
+
+            Returns: A tuple with the number of added and removed objects,
+            a dictionary with statistics of the update and the time it took,
+            or None if nothing changed.
+        """
         self.namespaces_lock.acquire()
-        self.have_objects_changed = False
-        self.namespaces = {}
+        start_time = time.time()
+        self.update_object_cache()
+        snapshot = self.take_catalog_snapshot()
+        added, removed = diff_catalog_snapshots(self.catalog_snapshot,
+                                                snapshot)
+        if not added and not removed:
+            self.namespaces_lock.release()
+            return None
+        # Only the changes that were applied are recorded in the catalog
+        # snapshot, so that a cancelled update is continued by the next one
+        applied = OrderedDict(self.catalog_snapshot)
+        try:
+            token.check()
+            # Objects without a definition get removed by process_object
+            for key in removed:
+                namespace, identifier = key
+                self.namespaces.get(namespace, set()).discard(identifier)
+                self.objects.put((namespace, identifier, None))
+                del applied[key]
+            stats = {"parsed": 0, "cached": 0, "skipped": 0,
+                     "animation_hits": 0, "animation_misses": 0}
+            file_namespaces = OrderedDict()
+            file_keys = {}
+            for key in added:
+                namespace = key[0]
+                filename = snapshot[key][0]
+                file_keys.setdefault(filename, []).append(key)
+                if filename not in file_namespaces:
+                    file_namespaces[filename] = [namespace]
+                elif namespace not in file_namespaces[filename]:
+                    stats["skipped"] += 1
+                    file_namespaces[filename].append(namespace)
+            added_set = set(added)
+            definitions = self.load_definitions(file_namespaces, stats)
+            try:
+                for filename, objects in definitions:
+                    token.check()
+                    for namespace in file_namespaces[filename]:
+                        known_ids = self.namespaces.setdefault(namespace,
+                                                               set())
+                        for obj in objects:
+                            identifier = obj.identifier
+                            if identifier in known_ids:
+                                continue
+                            if (namespace, identifier) not in added_set:
+                                continue
+                            known_ids.add(identifier)
+                            self.objects.put((namespace, identifier, obj))
+                    for key in file_keys[filename]:
+                        applied[key] = snapshot[key]
+            finally:
+                definitions.close()
+        finally:
+            self.catalog_snapshot = applied
+            self.object_cache.save()
+            self.namespaces_lock.release()
+        return len(added), len(removed), stats, time.time() - start_time
+
+    def cb_objects_updated(self, result):
+        """Called on the main thread when the update of the objects is done
+
+            Args:
+
+                result: The return value of update_objects_threaded
+        """
+        if result is None:
+            return
+        added, removed, stats, duration = result
+        print("Objects: %d added, %d removed, parsed %d files, %d from cache, "
+              "%d skipped, %d animation files parsed, %d reused in %.2fs" %
+              (added, removed, stats["parsed"], stats["cached"],
+               stats["skipped"], stats["animation_misses"],
+               stats["animation_hits"], duration))
+
+    def take_catalog_snapshot(self):
+        """Returns a snapshot of the objects of the model
+
+            Returns: An ordered dictionary mapping the namespace and
+            identifier of each object to the path and modification time of the
+            file the object was loaded from.
+        """
+        snapshot = OrderedDict()
         model = self.app.engine.getModel()
-        namespaces = model.getNamespaces()
-        for namespace in namespaces:
-            self.namespaces[namespace] = []
+        project_dir = self.app.project_source
+        for namespace in model.getNamespaces():
             objects = model.getObjects(namespace)
-            for fife_object in objects:
-                identifier = fife_object.getId()
-                if identifier in self.namespaces[namespace]:
-                    continue
-                if identifier in self.images:
-                    continue
-                project_dir = self.app.project_source
-                object_filename = fife_object.getFilename()
+            for object_filename, identifiers in group_objects_by_file(objects):
                 if project_dir is not None:
                     filename = os.path.join(project_dir, object_filename)
                 else:
                     filename = object_filename
+                try:
+                    mtime = os.path.getmtime(filename)
+                except OSError:
+                    mtime = None
+                for identifier in identifiers:
+                    snapshot[(namespace, identifier)] = (filename, mtime)
+        return snapshot
+
+    @property
+    def parser_workers(self):
+        """Returns the number of processes that are used to parse object
+        files"""
+        workers = int(self.app.settings.get("fife-rpg", "ObjectParserWorkers",
+                                            0))
+        if workers <= 0:
+            workers = multiprocessing.cpu_count()
+        return workers
+
+    def load_definitions(self, filenames, stats):
+        """Generator that yields the object definitions of files as soon as
+        they are available. Files that are not cached are parsed by a pool of
+        processes.
 
-                objects = parse_file(filename)
-                for obj in objects:
-                    identifier = obj["object"]["id"]
-                    if identifier in self.namespaces[namespace]:
-                        continue
-                    if identifier in self.images:
+            Args:
+
+                filenames: The paths to the object files
+
+                stats: A dictionary counting the parsed, cached and skipped
+                files
+
+            Yields: Tuples with the filename and the definitions of the file
+        """
+        missing = []
+        for filename in filenames:
+            definitions = self.object_cache.lookup(filename)
+            if definitions is None:
+                missing.append(filename)
+            else:
+                stats["cached"] += 1
+                yield filename, definitions
+        workers = min(self.parser_workers, len(missing))
+        if workers > 1:
+            executor = self.get_parser_executor()
+            futures = dict(
+                (executor.submit(parse_file_definitions, filename),
+                 filename) for filename in missing)
+            try:
+                for future in as_completed(futures):
+                    filename = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as error:  # pylint: disable=W0703
+                        print(error)
                         continue
-                    self.namespaces[namespace].append(identifier)
-                    self.objects.put((namespace, obj))
-        self.images_lock.acquire()
-        for image in self.images.values():
-            namespace, image_id = image.user_data
-            if image_id not in self.namespaces[namespace]:
-                wmgr = PyCEGUI.WindowManager.getSingleton()
-                image.getParent().removeChild(image)
-                wmgr.destroyWindow(image)
-                del self.images[image_id]
-        self.images_lock.release()
-        self.namespaces_lock.release()
+                    yield self.store_definitions(filename, result, stats)
+            finally:
+                # Files that were not parsed yet are not needed anymore
+                # when the update was cancelled
+                for future in futures:
+                    future.cancel()
+        else:
+            for filename in missing:
+                try:
+                    result = parse_file_definitions(filename)
+                except Exception as error:  # pylint: disable=W0703
+                    print(error)
+                    continue
+                yield self.store_definitions(filename, result, stats)
+
+    def store_definitions(self, filename, result, stats):
+        """Stores the parsed definitions of a file in the object cache
+
+            Args:
+
+                filename: The path to the object file
+
+                result: The result of parse_file_definitions for the file
+
+                stats: A dictionary counting the parsed files and animation
+                cache hits and misses
+
+            Returns: A tuple with the filename and the definitions
+        """
+        definitions, (ani_hits, ani_misses) = result
+        self.object_cache.store(filename, definitions)
+        stats["parsed"] += 1
+        stats["animation_hits"] += ani_hits
+        stats["animation_misses"] += ani_misses
+        return filename, definitions
+
+    def get_parser_executor(self):
+        """Returns the pool of processes that parse object files. The pool is
+        kept for the whole session so that the animation caches of the
+        processes are kept as well."""
+        if self.parser_executor is None:
+            # Forking the editor, which runs several threads, is not safe.
+            # The tasks are in a module that does not import the gui.
+            self.parser_executor = ProcessPoolExecutor(
+                max_workers=self.parser_workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self.parser_executor
+
+    def shutdown_parser_executor(self):
+        """Shuts down the pool of processes that parse object files"""
+        if self.parser_executor is not None:
+            self.parser_executor.shutdown(wait=False)
+            self.parser_executor = None
+
+    def update_object_cache(self):
+        """Makes sure the object cache uses the cache file of the current
+        project"""
+        cache_file = None
+        project_dir = self.app.project_dir
+        if project_dir is not None:
+            cache_file = os.path.join(get_cache_dir(project_dir),
+                                      OBJECT_CACHE_FILE)
+        if self.object_cache.cache_file != cache_file:
+            self.object_cache = ObjectDefinitionCache(cache_file)
 
     def process_object(self):
-        """Processes the next object in the Queue"""
+        """Processes the next object in the Queue
+
+            Returns: True if an object was taken from the Queue, False if the
+            Queue was empty.
+        """
         try:
-            namespace, obj = self.objects.get_nowait()
+            namespace, identifier, obj = self.objects.get_nowait()
         except Empty:
+            return False
+        if obj is None:
+            self.remove_object(namespace, identifier)
+            return True
+        name = ".".join([namespace, identifier])
+        if name in self.entry_defs:
+            return True
+        if identifier not in self.namespaces.get(namespace, ()):
+            return True
+        if obj.directions:
+            self.image_directions[name] = obj.directions
+        else:
+            self.image_directions[name] = (0,)
+        self.entry_defs[name] = (namespace, identifier, obj)
+        self.entries.append(name)
+        self.search_index.add(name, {"static": obj.static,
+                                     "blocking": obj.blocking})
+        if self.palette_entries is not self.entries:
+            if self.search_index.matches(name, self.search_query):
+                self.palette_entries.append(name)
+        self.palette_changed = True
+        return True
+
+    def define_image(self, name, obj):
+        """Creates the CEGUI image that is displayed for an object
+
+            Args:
+
+                name: The name of the image
+
+                obj: The preview record of the object
+        """
+        if self.define_atlas_image(name, obj):
+            self.defined_images.add(name)
             return
-        vec2f = PyCEGUI.Vector2f
-        sizef = PyCEGUI.Sizef
-        cegui_system = PyCEGUI.System.getSingleton()
-        renderer = cegui_system.getRenderer()
+        source, area = obj.thumbnail.path, obj.thumbnail.area
+        renderer = PyCEGUI.System.getSingleton().getRenderer()
         image_manager = PyCEGUI.ImageManager.getSingleton()
-        obj_def = obj["object"]
-        identifier = obj_def["id"]
-        name = ".".join([namespace, identifier])
-        if name in self.images:
+        if area is None:
+            tex_name = name
+        else:
+            tex_name = ".".join([source, "atlas"])
+        if renderer.isTextureDefined(tex_name):
+            tex = renderer.getTexture(tex_name)
+        else:
+            tex = renderer.createTexture(tex_name, source, "FIFE")
+        if area is None:
+            pos = PyCEGUI.Vector2f(0, 0)
+            size = PyCEGUI.Sizef(tex.getSize().d_width,
+                                 tex.getSize().d_height)
+        else:
+            x_pos, y_pos, width, height = area
+            pos = PyCEGUI.Vector2f(float(x_pos), float(y_pos))
+            size = PyCEGUI.Sizef(float(width), float(height))
+        if not image_manager.isDefined(name):
+            image = image_manager.create("BasicImage", name)
+            image.setTexture(tex)
+            image.setArea(PyCEGUI.Rectf(pos, size))
+        self.defined_images.add(name)
+
+    def define_atlas_image(self, name, obj):
+        """Creates the CEGUI image that is displayed for an object from a
+        thumbnail in the thumbnail atlas
+
+            Args:
+
+                name: The name of the image
+
+                obj: The preview record of the object
+
+            Returns: True if the image was created, False if the atlas is
+            not available or the thumbnail could not be created.
+        """
+        if self.thumbnail_atlas is None:
+            if not thumbnail_atlas.is_available():
+                return False
+            page_dir = tempfile.mkdtemp(prefix="fife-rpg-editor")
+            cache_dir = None
+            if self.app.project_dir is not None:
+                cache_dir = os.path.join(get_cache_dir(self.app.project_dir),
+                                         THUMBNAIL_CACHE_DIR)
+            self.thumbnail_atlas = ThumbnailAtlas(page_dir, cache_dir)
+        source, area = obj.thumbnail.path, obj.thumbnail.area
+        placement = self.thumbnail_atlas.add(source, area)
+        if placement is None:
+            return False
+        self.thumbnails_added += 1
+        page, x_pos, y_pos, width, height = placement
+        renderer = PyCEGUI.System.getSingleton().getRenderer()
+        tex_name = self.get_atlas_texture_name(page)
+        if renderer.isTextureDefined(tex_name):
+            tex = renderer.getTexture(tex_name)
+        else:
+            tex = renderer.createTexture(tex_name)
+        area = PyCEGUI.Rectf(PyCEGUI.Vector2f(x_pos, y_pos),
+                             PyCEGUI.Sizef(width, height))
+        image = PyCEGUI.ImageManager.getSingleton().create("BasicImage", name)
+        image.setTexture(tex)
+        image.setArea(area)
+        return True
+
+    @staticmethod
+    def get_atlas_texture_name(page):
+        """Returns the name of the texture of a page of the thumbnail atlas
+
+            Args:
+
+                page: The index of the page
+        """
+        return "ObjectsPalette/Atlas%d" % page
+
+    def flush_thumbnail_atlas(self):
+        """Saves the changed pages of the thumbnail atlas and reloads their
+        textures. Called once per frame. The page that is still being filled
+        is only saved in a frame that added no thumbnails, so it is not
+        written again for every few thumbnails."""
+        if self.thumbnail_atlas is None:
             return
-        img_def = {}
-        img_def["static"] = obj_def["static"]
-        dirs = []
-        if int(obj_def["static"]) == 0:
-            actions = obj["actions"]
-            img_def["actions"] = {}
-            actions_dict = img_def["actions"]
-            action, action_def = next(iter(actions.items()))
-            img_type = action_def["type"]
-            if img_type == "single":
-                atlas_def = action_def["atlas"]
-                fname = atlas_def["image"]
-                if renderer.isTextureDefined(name):
-                    tex = renderer.getTexture(name)
-                else:
-                    tex = renderer.createTexture(name, fname, "FIFE")
-                tex_size = tex.getSize()
-                tex_width = tex_size.d_width
-                frame_width = int(atlas_def["width"])
-                frame_height = int(atlas_def["height"])
-                frames_p_line = old_div(tex_width, frame_width)
-                frame_count = 0
-            dirs_def = action_def["directions"]
-            actions_dict[action] = {}
-            dirs = sorted(dirs_def.keys())
-            dir_def = dirs_def[dirs[0]]
-
-            if img_type == "multi":
-                frame = dir_def["frames"][0]
-                if not renderer.isTextureDefined(name):
-                    tex = renderer.createTexture(name, frame, "FIFE")
-                    pos = vec2f(0, 0)
-                    size = sizef(
-                        tex.getSize().d_width,
-                        tex.getSize().d_height)
-                    area = PyCEGUI.Rectf(pos, size)
-                    image = image_manager.create("BasicImage", name)
-                    image.setTexture(tex)
-                    image.setArea(area)
-            elif img_type == "single":
-                line = old_div(frame_count, frames_p_line)
-                col = frame_count % frames_p_line
-                pos = vec2f(col * frame_width,
-                            line * frame_height)
-                size = sizef(frame_width,
-                             frame_height)
-                area = PyCEGUI.Rectf(pos, size)
-                if not image_manager.isDefined(name):
-                    image = image_manager.create("BasicImage", name)
-                    image.setTexture(tex)
-                    image.setArea(area)
-                frame_count = frame_count + 1
-        elif int(obj_def["static"]) == 1:
-            img_def["directions"] = []
-            dirs_def = obj["directions"]
-            dirs = sorted(dirs_def.keys())
-            dir_def = dirs_def[dirs[0]]
-            source = dir_def["source"]
-            if dir_def["type"] == "atlas":
-                tex_name = ".".join([source, "atlas"])
-
-                if not renderer.isTextureDefined(tex_name):
-                    tex = renderer.createTexture(tex_name, source, "FIFE")
-                else:
-                    tex = renderer.getTexture(tex_name)
-                pos = vec2f(float(dir_def["xpos"]),
-                            float(dir_def["ypos"]))
-                size = sizef(float(dir_def["width"]),
-                             float(dir_def["height"]))
-                area = PyCEGUI.Rectf(pos, size)
-                image = image_manager.create("BasicImage", name)
-                image.setTexture(tex)
-                image.setArea(area)
-            elif dir_def["type"] == "image":
-                if not renderer.isTextureDefined(name):
-                    tex = renderer.createTexture(name, source, "FIFE")
-                    pos = vec2f(0, 0)
-                    size = sizef(tex.getSize().d_width, tex.getSize().d_height)
-                    area = PyCEGUI.Rectf(pos, size)
-                    image = image_manager.create("BasicImage", name)
-                    image.setTexture(tex)
-                    image.setArea(area)
-        name = ".".join([namespace, identifier])
-        wmgr = PyCEGUI.WindowManager.getSingleton()
-        if name not in self.images:
-            image = wmgr.createWindow(
-                "TaharezLook/StaticImage", name)
-            image.setTooltipText(name)
-            image.setProperty("Image", name)
-            self.items.addChild(image)
-            if dirs:
-                self.image_directions[name] = dirs
-            else:
-                self.image_directions[name] = [0]
-            image.setAlpha(self.DEFAULT_ALPHA)
-            image.user_data = [namespace, identifier]
+        partial = self.thumbnails_added == 0
+        self.thumbnails_added = 0
+        renderer = PyCEGUI.System.getSingleton().getRenderer()
+        for page in self.thumbnail_atlas.flush(partial):
+            tex = renderer.getTexture(self.get_atlas_texture_name(page))
+            tex.loadFromFile(self.thumbnail_atlas.get_page_filename(page),
+                             "FIFE")
+
+    def clear_thumbnail_atlas(self):
+        """Removes the thumbnail atlas and its textures"""
+        if self.thumbnail_atlas is None:
+            return
+        renderer = PyCEGUI.System.getSingleton().getRenderer()
+        for page in range(len(self.thumbnail_atlas.pages)):
+            tex_name = self.get_atlas_texture_name(page)
+            if renderer.isTextureDefined(tex_name):
+                renderer.destroyTexture(tex_name)
+        shutil.rmtree(self.thumbnail_atlas.page_dir, True)
+        self.thumbnail_atlas = None
+
+    def update_palette(self):
+        """Shows the objects of the rows that are visible in the palette.
+        Windows of rows that are no longer visible are reused."""
+        panel = self.items_panel
+        viewable_area = panel.getViewableArea()
+        view_height = viewable_area.getHeight()
+        entries = self.palette_entries
+        content_height = len(entries) * self.ROW_HEIGHT
+        if self.palette_changed:
+            self.palette_changed = False
+            panel.setContentPaneArea(PyCEGUI.Rectf(
+                PyCEGUI.Vector2f(0, 0),
+                PyCEGUI.Sizef(viewable_area.getWidth(), content_height)))
+        scroll_range = max(content_height - view_height, 0)
+        top = panel.getVerticalScrollPosition() * scroll_range
+        first = max(int(top // self.ROW_HEIGHT) - self.OVERSCAN_ROWS, 0)
+        last = int((top + view_height) // self.ROW_HEIGHT) + 1
+        last = min(last + self.OVERSCAN_ROWS, len(entries))
+        visible = entries[first:last]
+        visible_names = set(visible)
+        for name in list(self.images.keys()):
+            if name not in visible_names:
+                self.release_window(name)
+        for row, name in enumerate(visible, first):
+            window = self.images.get(name)
+            if window is None:
+                window = self.materialize_window(name)
+            window.setYPosition(PyCEGUI.UDim(0, row * self.ROW_HEIGHT))
+
+    def materialize_window(self, name):
+        """Shows an object of the palette in a window
+
+            Args:
+
+                name: The name of the object
+
+            Returns: The window that displays the object
+        """
+        namespace, identifier, obj = self.entry_defs[name]
+        if name not in self.defined_images:
+            self.define_image(name, obj)
+        if self.free_windows:
+            image = self.free_windows.pop()
+            image.show()
+        else:
+            wmgr = PyCEGUI.WindowManager.getSingleton()
+            image = wmgr.createWindow("TaharezLook/StaticImage",
+                                      "PaletteItem%d" % self.window_count)
+            self.window_count += 1
+            image.setSize(PyCEGUI.USize(PyCEGUI.UDim(1.0, 0),
+                                        PyCEGUI.UDim(0, self.ROW_HEIGHT)))
             image.subscribeEvent(PyCEGUI.Window.EventMouseClick,
                                  self.image_clicked)
-            self.images_lock.acquire()
-            self.images[name] = image
-            self.images_lock.release()
+            self.items_panel.addChild(image)
+        image.setTooltipText(name)
+        image.setProperty("Image", name)
+        if self.selected_object == [namespace, identifier]:
+            image.setAlpha(self.HIGHLIGHT_ALPHA)
+        else:
+            image.setAlpha(self.DEFAULT_ALPHA)
+        image.user_data = [namespace, identifier]
+        self.images_lock.acquire()
+        self.images[name] = image
+        self.images_lock.release()
+        return image
+
+    def release_window(self, name):
+        """Hides the window of an object so that it can be reused
+
+            Args:
+
+                name: The name of the object
+        """
+        self.images_lock.acquire()
+        image = self.images.pop(name)
+        self.images_lock.release()
+        image.hide()
+        image.user_data = None
+        self.free_windows.append(image)
+
+    def remove_object(self, namespace, identifier):
+        """Removes an object from the toolbar
+
+            Args:
+
+                namespace: The namespace of the object
+
+                identifier: The name of the object
+        """
+        name = ".".join([namespace, identifier])
+        if name not in self.entry_defs:
+            return
+        if self.selected_object == [namespace, identifier]:
+            self.selected_object = [None, None]
+        del self.entry_defs[name]
+        del self.image_directions[name]
+        self.entries.remove(name)
+        self.search_index.remove(name)
+        if self.palette_entries is not self.entries:
+            if name in self.palette_entries:
+                self.palette_entries.remove(name)
+        self.palette_changed = True
+        if name in self.images:
+            self.release_window(name)
+        if name in self.defined_images:
+            self.defined_images.remove(name)
+            image_manager = PyCEGUI.ImageManager.getSingleton()
+            if image_manager.isDefined(name):
+                image_manager.destroy(name)
+            renderer = PyCEGUI.System.getSingleton().getRenderer()
+            if renderer.isTextureDefined(name):
+                renderer.destroyTexture(name)
 
     def activate(self):
         """Called when the page gets activated"""
         self.is_active = True
+        self.max_frame_budget = float(self.app.settings.get(
+            "fife-rpg", "ObjectPaletteBudget", self.DEFAULT_FRAME_BUDGET))
+        self.frame_budget = self.max_frame_budget
+        self.last_update_time = None
 
     def deactivate(self):
         """Called when the page gets deactivated"""
@@ -515,7 +748,8 @@ class ObjectToolbar(ToolbarPage):
         if namespace is not None:
             identifier = ".".join((namespace, name))
             self.images_lock.acquire()
-            self.images[identifier].setAlpha(self.DEFAULT_ALPHA)
+            if identifier in self.images:
+                self.images[identifier].setAlpha(self.DEFAULT_ALPHA)
             self.images_lock.release()
         self.selected_object = [None, None]
         self.clean_mouse_instance()
@@ -532,6 +766,65 @@ class ObjectToolbar(ToolbarPage):
         """
         self.have_objects_changed = True
 
+    def cb_map_pressed(self, click_point, button):
+        """Called when a mouse button was pressed over the map. Starts a paint
+        stroke, which is undone and redone as a whole.
+
+        Args:
+
+            click_point: A fife.ScreenPoint with the the position that was
+            clicked on the screen
+
+            button: The button that was pressed
+        """
+        self.end_paint_stroke()
+        if self.app.editor_gui.selected_layer is not None and self.is_active:
+            self.app.editor.undo_manager.begin_transaction(_("Paint objects"))
+            self.is_painting = True
+        self.cb_map_clicked(click_point, button)
+
+    def cb_map_dragged(self, click_point, button):
+        """Called when the mouse was moved over the map while a button is
+        pressed. Each cell is only painted once per paint stroke, so the
+        stroke never replaces the instances it created itself.
+
+        Args:
+
+            click_point: A fife.ScreenPoint with the the position the mouse is
+            on the screen
+
+            button: The button that is pressed
+        """
+        if self.app.editor_gui.selected_layer is None or not self.is_active:
+            return
+        location = self.app.screen_coords_to_map_coords(
+            click_point, self.app.editor_gui.selected_layer
+        )
+        cell = location.getLayerCoordinates()
+        if (cell.x, cell.y) in self.painted_cells:
+            return
+        self.cb_map_clicked(click_point, button)
+
+    def cb_map_released(self, click_point, button):
+        """Called when a mouse button was released over the map. Ends the
+        paint stroke.
+
+        Args:
+
+            click_point: A fife.ScreenPoint with the the position the mouse is
+            on the screen
+
+            button: The button that was released
+        """
+        self.end_paint_stroke()
+
+    def end_paint_stroke(self):
+        """Commits the undo transaction of the current paint stroke"""
+        self.painted_cells = set()
+        if self.is_painting:
+            self.is_painting = False
+            self.app.editor.undo_manager.commit_transaction()
+
     def cb_map_clicked(self, click_point, button):
         """Called when a position on the screen was clicked
 
@@ -555,8 +848,11 @@ class ObjectToolbar(ToolbarPage):
         location = self.app.screen_coords_to_map_coords(
             click_point, self.app.editor_gui.selected_layer
         )
+        cell = location.getLayerCoordinates()
+        if self.is_painting:
+            self.painted_cells.add((cell.x, cell.y))
         world = self.app.world
-        for instance in layer.getInstancesAt(location):
+        for instance in self.app.editor.get_instances_at(location):
             if world.is_identifier_used(instance.getId()):
                 continue
             action = UndoRemoveInstance(self.app.editor, instance)
@@ -629,19 +925,87 @@ class ObjectToolbar(ToolbarPage):
                 if self.last_instance is not None:
                     self.last_instance.setRotation(self.cur_rotation)
 
+    def shutdown(self):
+        """Removes the thumbnail atlas pages and stops the parser
+        processes"""
+        self.shutdown_parser_executor()
+        self.clear_thumbnail_atlas()
+
     def cb_project_closed(self):
         """Called when the current project was closed"""
+        self.end_paint_stroke()
+        self.app.scheduler.cancel(self.UPDATE_TASK)
+        self.namespaces_lock.acquire()
         self.namespaces = {}
+        self.catalog_snapshot = OrderedDict()
+        self.objects = Queue()
+        self.object_cache = ObjectDefinitionCache()
+        self.namespaces_lock.release()
+        self.shutdown_parser_executor()
+        ANIMATION_CACHE.clear()
         self.images_lock.acquire()
-        for image in self.images:
+        for image in self.defined_images:
             PyCEGUI.ImageManager.getSingleton().destroy(image)
+        self.defined_images = set()
+        self.clear_thumbnail_atlas()
+        windows = list(self.images.values()) + self.free_windows
+        for window in windows:
+            self.items_panel.destroyChild(window)
         self.images = {}
+        self.free_windows = []
         self.images_lock.release()
+        self.entries = []
+        self.search_index.clear()
+        self.entry_defs = {}
+        self.image_directions = {}
         self.selected_object = [None, None]
-        if self.items:
-            self.items_panel.destroyChild(self.items)
-        self.items = self.items_panel.createChild("VerticalLayoutContainer",
-                                                  "Items")
+        self.set_search_query(self.search_query)
+
+    def set_search_query(self, query):
+        """Shows only the objects that match a query in the palette
+
+            Args:
+
+                query: The query, see object_search.parse_query
+        """
+        self.search_query = query
+        matches = self.search_index.search(query)
+        if matches is None:
+            self.palette_entries = self.entries
+        else:
+            self.palette_entries = [name for name in self.entries
+                                    if name in matches]
+        self.palette_changed = True
+        self.items_panel.setVerticalScrollPosition(0)
+        self.update_palette()
+
+    def cb_search_changed(self, args):
+        """Called when the text of the search box was changed
+
+            Args:
+
+                args: PyCEGUI.WindowEventArgs
+        """
+        self.set_search_query(args.window.getText())
+
+    def cb_palette_scrolled(self, args):
+        """Called when the palette was scrolled
+
+            Args:
+
+                args: The args of the event
+        """
+        self.update_palette()
+
+    def cb_palette_sized(self, args):
+        """Called when the size of the palette changed
+
+            Args:
+
+                args: The args of the event
+        """
+        self.palette_changed = True
+        self.update_palette()
 
     def cb_objects_imported(self):
         """Called when objects where imported to the project"""
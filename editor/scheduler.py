@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains a scheduler for running tasks in the background
+
+.. module:: scheduler
+    :synopsis: Contains a scheduler for running tasks in the background
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+from collections import OrderedDict
+from queue import Queue, Empty
+import threading
+
+
+class TaskCancelled(Exception):
+
+    """Raised by a CancellationToken when its task was cancelled"""
+
+
+class CancellationToken(object):
+
+    """Tells a running task that it should stop"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        """Marks the task as cancelled"""
+        self.cancelled = True
+
+    def check(self):
+        """Raises TaskCancelled if the task was cancelled"""
+        if self.cancelled:
+            raise TaskCancelled()
+
+
+class Task(object):
+
+    """A task of the scheduler"""
+
+    def __init__(self, key, func, args, callback):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.token = CancellationToken()
+
+
+class TaskScheduler(object):
+
+    """Runs tasks on a background thread. A task that is submitted with the
+    same key as a waiting or running task supersedes it. The results of
+    tasks are passed to their callbacks on the main thread, by calling
+    process_completed."""
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.running = None
+        self.completed = Queue()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def submit(self, key, func, args=(), callback=None):
+        """Adds a task to the scheduler. The function is called as
+        func(token, *args) on the background thread and should check the
+        token regularly.
+
+            Args:
+
+                key: The key of the task. Waiting or running tasks with the
+                same key are cancelled.
+
+                func: The function of the task
+
+                args: Additional arguments for the function
+
+                callback: Called on the main thread with the return value of
+                the function, unless the task was cancelled.
+
+            Returns: The CancellationToken of the task
+        """
+        task = Task(key, func, args, callback)
+        with self.condition:
+            self.cancel_locked(key)
+            self.pending[key] = task
+            if self.thread is None:
+                self.stopped = False
+                self.thread = threading.Thread(target=self.run,
+                                               name="TaskScheduler")
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return task.token
+
+    def cancel(self, key):
+        """Cancels the waiting or running task with the key
+
+            Args:
+
+                key: The key of the task
+        """
+        with self.condition:
+            self.cancel_locked(key)
+
+    def cancel_locked(self, key):
+        """Cancels the waiting or running task with the key. The condition
+        has to be acquired.
+
+            Args:
+
+                key: The key of the task
+        """
+        task = self.pending.pop(key, None)
+        if task is not None:
+            task.token.cancel()
+        if self.running is not None and self.running.key == key:
+            self.running.token.cancel()
+
+    def run(self):
+        """Runs the tasks. This is the function of the background thread."""
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, task = self.pending.popitem(last=False)
+                self.running = task
+            try:
+                result = task.func(task.token, *task.args)
+            except TaskCancelled:
+                pass
+            except Exception as error:  # pylint: disable=broad-except
+                self.completed.put((task, None, error))
+            else:
+                self.completed.put((task, result, None))
+            with self.condition:
+                self.running = None
+
+    def process_completed(self):
+        """Calls the callbacks of the finished tasks. Has to be called on
+        the main thread."""
+        while True:
+            try:
+                task, result, error = self.completed.get_nowait()
+            except Empty:
+                return
+            if task.token.cancelled:
+                continue
+            if error is not None:
+                print(error)
+            elif task.callback is not None:
+                task.callback(result)
+
+    def shutdown(self):
+        """Cancels all tasks and stops the background thread"""
+        with self.condition:
+            for key in list(self.pending.keys()):
+                self.cancel_locked(key)
+            if self.running is not None:
+                self.running.token.cancel()
+            self.stopped = True
+            self.condition.notify()
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains a spatial index of the instances on the layers of maps
+
+.. module:: spatial_index
+    :synopsis: Contains a spatial index of the instances on the layers of maps
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from __future__ import division
+
+from builtins import object
+from builtins import range
+import math
+
+BUCKET_SIZE = 16
+
+
+class InstanceGrid(object):
+
+    """A uniform grid hash of the instances of a layer. Instances are stored
+    by their cell for point queries and by buckets of cells for rectangle
+    and radius queries."""
+
+    def __init__(self, bucket_size=BUCKET_SIZE):
+        """Constructor
+
+        Args:
+
+            bucket_size: The width and height of a bucket, in cells
+        """
+        self.bucket_size = bucket_size
+        self.cells = {}
+        self.buckets = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_bucket(self, x_pos, y_pos):
+        """Returns the key of the bucket that contains a position
+
+        Args:
+
+            x_pos: The x coordinate
+
+            y_pos: The y coordinate
+        """
+        return (int(math.floor(x_pos / self.bucket_size)),
+                int(math.floor(y_pos / self.bucket_size)))
+
+    def insert(self, key, cell, position, item):
+        """Adds an item to the grid. An item with the same key is replaced.
+
+        Args:
+
+            key: A unique key of the item
+
+            cell: A tuple with the x and y coordinates of the cell of the item
+
+            position: A tuple with the exact x and y coordinates of the item
+
+            item: The item
+        """
+        if key in self.entries:
+            self.remove(key)
+        bucket = self.get_bucket(*position)
+        self.entries[key] = (cell, bucket)
+        self.cells.setdefault(cell, {})[key] = item
+        self.buckets.setdefault(bucket, {})[key] = (position, item)
+
+    def remove(self, key):
+        """Removes an item from the grid
+
+        Args:
+
+            key: The key of the item
+
+        Returns: True if the item was in the grid, False if not
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        cell, bucket = entry
+        items = self.cells[cell]
+        del items[key]
+        if not items:
+            del self.cells[cell]
+        items = self.buckets[bucket]
+        del items[key]
+        if not items:
+            del self.buckets[bucket]
+        return True
+
+    def get(self, key):
+        """Returns an item of the grid
+
+        Args:
+
+            key: The key of the item
+
+        Returns: The item or None if there is no item with the key
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return self.cells[entry[0]][key]
+
+    def query_cell(self, cell):
+        """Returns the items in a cell
+
+        Args:
+
+            cell: A tuple with the x and y coordinates of the cell
+        """
+        return list(self.cells.get(cell, {}).values())
+
+    def iter_buckets(self, min_x, min_y, max_x, max_y):
+        """Yields the buckets that overlap a rectangle
+
+        Args:
+
+            min_x: The lowest x coordinate of the rectangle
+
+            min_y: The lowest y coordinate of the rectangle
+
+            max_x: The highest x coordinate of the rectangle
+
+            max_y: The highest y coordinate of the rectangle
+        """
+        first_x, first_y = self.get_bucket(min_x, min_y)
+        last_x, last_y = self.get_bucket(max_x, max_y)
+        area = (last_x - first_x + 1) * (last_y - first_y + 1)
+        if area > len(self.buckets):
+            for (bucket_x, bucket_y), items in self.buckets.items():
+                if (first_x <= bucket_x <= last_x and
+                        first_y <= bucket_y <= last_y):
+                    yield items
+            return
+        for bucket_x in range(first_x, last_x + 1):
+            for bucket_y in range(first_y, last_y + 1):
+                items = self.buckets.get((bucket_x, bucket_y))
+                if items is not None:
+                    yield items
+
+    def query_rect(self, min_x, min_y, max_x, max_y):
+        """Returns the items whose exact position is inside a rectangle
+
+        Args:
+
+            min_x: The lowest x coordinate of the rectangle
+
+            min_y: The lowest y coordinate of the rectangle
+
+            max_x: The highest x coordinate of the rectangle
+
+            max_y: The highest y coordinate of the rectangle
+        """
+        result = []
+        for items in self.iter_buckets(min_x, min_y, max_x, max_y):
+            for (x_pos, y_pos), item in items.values():
+                if min_x <= x_pos <= max_x and min_y <= y_pos <= max_y:
+                    result.append(item)
+        return result
+
+    def query_radius(self, center, radius):
+        """Returns the items whose exact position is inside a circle
+
+        Args:
+
+            center: A tuple with the x and y coordinates of the center
+
+            radius: The radius of the circle
+        """
+        center_x, center_y = center
+        squared_radius = radius * radius
+        result = []
+        for items in self.iter_buckets(center_x - radius, center_y - radius,
+                                       center_x + radius, center_y + radius):
+            for (x_pos, y_pos), item in items.values():
+                distance_x = x_pos - center_x
+                distance_y = y_pos - center_y
+                if (distance_x * distance_x +
+                        distance_y * distance_y) <= squared_radius:
+                    result.append(item)
+        return result
+
+
+class SpatialIndex(object):
+
+    """Keeps an InstanceGrid for each layer of each map"""
+
+    def __init__(self, bucket_size=BUCKET_SIZE):
+        """Constructor
+
+        Args:
+
+            bucket_size: The width and height of the buckets of the grids, in
+            cells
+        """
+        self.bucket_size = bucket_size
+        self.grids = {}
+
+    def get_grid(self, map_name, layer_name, create=False):
+        """Returns the grid of a layer
+
+        Args:
+
+            map_name: The name of the map
+
+            layer_name: The name of the layer
+
+            create: Whether to create the grid if the layer has none
+
+        Returns: The InstanceGrid of the layer, or None if the layer has
+        no grid and create is False.
+        """
+        key = (map_name, layer_name)
+        grid = self.grids.get(key)
+        if grid is None and create:
+            grid = self.grids[key] = InstanceGrid(self.bucket_size)
+        return grid
+
+    def remove_layer(self, map_name, layer_name):
+        """Removes the grid of a layer
+
+        Args:
+
+            map_name: The name of the map
+
+            layer_name: The name of the layer
+        """
+        self.grids.pop((map_name, layer_name), None)
+
+    def remove_map(self, map_name):
+        """Removes the grids of all layers of a map
+
+        Args:
+
+            map_name: The name of the map
+        """
+        for key in list(self.grids.keys()):
+            if key[0] == map_name:
+                del self.grids[key]
+
+    def clear(self):
+        """Removes all grids"""
+        self.grids = {}
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Contains the packing of object thumbnails into atlas pages
+
+.. module:: thumbnail_atlas
+    :synopsis: Contains the packing of object thumbnails into atlas pages
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+import hashlib
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZE = 64
+PAGE_SIZE = 1024
+PADDING = 1
+THUMBNAIL_CACHE_DIR = "thumbnails"
+
+
+def is_available():
+    """Returns whether thumbnails can be packed. This needs PIL (Pillow)."""
+    return Image is not None
+
+
+def get_thumbnail_source(obj):
+    """Returns the image that represents an object and the area of the
+    object in that image.
+
+    Args:
+
+        obj: The definition of the object
+
+    Returns: A tuple with the path to the image and a tuple with the x
+    position, y position, width and height of the area, or None if the whole
+    image is used.
+    """
+    obj_def = obj["object"]
+    if int(obj_def["static"]) == 0:
+        action_def = next(iter(obj["actions"].values()))
+        if action_def["type"] == "single":
+            atlas_def = action_def["atlas"]
+            return atlas_def["image"], (0, 0, int(atlas_def["width"]),
+                                        int(atlas_def["height"]))
+        dirs_def = action_def["directions"]
+        dir_def = dirs_def[min(dirs_def.keys())]
+        return dir_def["frames"][0], None
+    dirs_def = obj["directions"]
+    dir_def = dirs_def[min(dirs_def.keys())]
+    if dir_def["type"] == "atlas":
+        return dir_def["source"], (int(dir_def["xpos"]), int(dir_def["ypos"]),
+                                   int(dir_def["width"]),
+                                   int(dir_def["height"]))
+    return dir_def["source"], None
+
+
+class AtlasPage(object):
+
+    """A single page of a thumbnail atlas"""
+
+    def __init__(self, size):
+        self.image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        self.shelf_y = 0
+        self.shelf_height = 0
+        self.cursor_x = 0
+        self.changed = False
+        self.full = False
+
+
+class ThumbnailAtlas(object):
+
+    """Downscales images of objects and packs them into a few large pages,
+    using a shelf packing algorithm."""
+
+    def __init__(self, page_dir, cache_dir=None, page_size=PAGE_SIZE,
+                 thumbnail_size=THUMBNAIL_SIZE):
+        """Constructor
+
+        Args:
+
+            page_dir: The directory the pages are saved to
+
+            cache_dir: The directory in which scaled down thumbnails are
+            cached. If None thumbnails are not cached.
+
+            page_size: The width and height of a page
+
+            thumbnail_size: The maximum width and height of a thumbnail
+        """
+        self.page_dir = page_dir
+        self.cache_dir = cache_dir
+        self.page_size = page_size
+        self.thumbnail_size = thumbnail_size
+        self.pages = []
+
+    def get_page_filename(self, index):
+        """Returns the path to the file of a page
+
+        Args:
+
+            index: The index of the page
+        """
+        return os.path.join(self.page_dir, "page%d.png" % index)
+
+    def get_cache_filename(self, source, area=None):
+        """Returns the path of the cached thumbnail of an image. The name
+        depends on the path and modification time of the image, the area
+        and the thumbnail size.
+
+        Args:
+
+            source: The path to the image
+
+            area: The x position, y position, width and height of the area
+            of the image to use. If None the whole image is used.
+        """
+        source = os.path.abspath(source)
+        key = "%s|%r|%r|%d" % (source, os.path.getmtime(source), area,
+                               self.thumbnail_size)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "%s.png" % digest)
+
+    def create_thumbnail(self, source, area=None):
+        """Loads the thumbnail of an image from the cache or creates it by
+        scaling the image down to the thumbnail size.
+
+        Args:
+
+            source: The path to the image
+
+            area: The x position, y position, width and height of the area
+            of the image to use. If None the whole image is used.
+
+        Returns: The thumbnail as a PIL image.
+        """
+        if self.cache_dir is None:
+            return self.scale_image(source, area)
+        cache_filename = self.get_cache_filename(source, area)
+        if os.path.isfile(cache_filename):
+            try:
+                thumbnail = Image.open(cache_filename)
+                thumbnail.load()
+                return thumbnail
+            except (IOError, OSError):
+                pass
+        thumbnail = self.scale_image(source, area)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            thumbnail.save(cache_filename)
+        except (IOError, OSError) as error:
+            print(error)
+        return thumbnail
+
+    def scale_image(self, source, area=None):
+        """Loads an image and scales it down to the thumbnail size
+
+        Args:
+
+            source: The path to the image
+
+            area: The x position, y position, width and height of the area
+            of the image to use. If None the whole image is used.
+
+        Returns: The thumbnail as a PIL image.
+        """
+        image = Image.open(source)
+        if area is not None:
+            x_pos, y_pos, width, height = area
+            image = image.crop((x_pos, y_pos, x_pos + width, y_pos + height))
+        image = image.convert("RGBA")
+        image.thumbnail((self.thumbnail_size, self.thumbnail_size),
+                        Image.LANCZOS)
+        return image
+
+    def add(self, source, area=None):
+        """Adds the thumbnail of an image to the atlas
+
+        Args:
+
+            source: The path to the image
+
+            area: The x position, y position, width and height of the area
+            of the image to use. If None the whole image is used.
+
+        Returns: A tuple with the index of the page and the x position,
+        y position, width and height of the thumbnail on that page, or None
+        if the image could not be loaded.
+        """
+        try:
+            thumbnail = self.create_thumbnail(source, area)
+        except (IOError, OSError) as error:
+            print(error)
+            return None
+        return self.pack(thumbnail)
+
+    def pack(self, thumbnail):
+        """Places a thumbnail on a page
+
+        Args:
+
+            thumbnail: The thumbnail as a PIL image
+
+        Returns: A tuple with the index of the page and the x position,
+        y position, width and height of the thumbnail on that page.
+        """
+        width, height = thumbnail.size
+        page = self.pages[-1] if self.pages else None
+        if page is not None and page.cursor_x + width > self.page_size:
+            page.shelf_y += page.shelf_height + PADDING
+            page.shelf_height = 0
+            page.cursor_x = 0
+        if page is None or page.shelf_y + height > self.page_size:
+            if page is not None:
+                page.full = True
+            page = AtlasPage(self.page_size)
+            self.pages.append(page)
+        x_pos, y_pos = page.cursor_x, page.shelf_y
+        page.image.paste(thumbnail, (x_pos, y_pos))
+        page.cursor_x += width + PADDING
+        page.shelf_height = max(page.shelf_height, height)
+        page.changed = True
+        return len(self.pages) - 1, x_pos, y_pos, width, height
+
+    def flush(self, partial=True):
+        """Saves the pages that were changed since the last flush
+
+        Args:
+
+            partial: Whether to save the page that is still being filled.
+            Full pages are always saved, so that each of them is only
+            written once.
+
+        Returns: A list with the indices of the saved pages
+        """
+        if not os.path.isdir(self.page_dir):
+            os.makedirs(self.page_dir)
+        saved = []
+        for index, page in enumerate(self.pages):
+            if not page.changed or not (page.full or partial):
+                continue
+            page.image.save(self.get_page_filename(index), compress_level=1)
+            page.changed = False
+            saved.append(index)
+        return saved
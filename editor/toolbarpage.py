@@ -52,3 +52,6 @@ class ToolbarPage(object):
     @abstractmethod
     def deactivate(self):
         """Called when the page gets deactivated"""
+
+    def shutdown(self):
+        """Called when the editor is closed"""
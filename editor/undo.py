@@ -22,7 +22,13 @@
 
 from builtins import object
 from abc import ABCMeta, abstractmethod
+from collections import deque
 from copy import copy
+import os
+import pickle
+import sys
+import tempfile
+import time
 from future.utils import with_metaclass
 
 
@@ -34,7 +40,11 @@ class UndoError(Exception):
 
 
 class UndoableAction(with_metaclass(ABCMeta, object)):
-    """An Action that can be undone"""
+    """An Action that can be undone. Actions that set restorable to True
+    implement to_record and the class method from_record(record, context),
+    which recreates the action from the data returned by to_record."""
+
+    restorable = False
 
     def __init__(self, description):
         self.description = description
@@ -47,15 +57,276 @@ class UndoableAction(with_metaclass(ABCMeta, object)):
     def undo(self):
         """Undo the action"""
 
+    def get_size(self):
+        """Returns an estimate of the memory the action uses, in bytes"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+        for value in self.__dict__.values():
+            size += sys.getsizeof(value)
+        return size
+
+    def merge(self, action):
+        """Tries to merge a newer action into this one, so that both are
+        undone in one step. Both actions are already done.
+
+        Args:
+
+            action: The newer action
+
+        Returns: True if the action was merged, False if not
+        """
+        return False
+
+    def to_record(self):
+        """Returns the data of the done action as a value that can be
+        pickled, or None if the action can not be stored that way.
+        The action can be recreated with from_record."""
+        return None
+
+    def get_record(self):
+        """Returns the data of the done action like to_record, or None if
+        the action is not restorable. Actions without a record are never
+        spilled."""
+        if not self.restorable:
+            return None
+        return self.to_record()
+
+
+class SpilledAction(object):
+
+    """Takes the place of an action that was moved to the spill file of an
+    UndoManager"""
+
+    def __init__(self, description, offset, length):
+        self.description = description
+        self.offset = offset
+        self.length = length
+
+
+class CompoundAction(UndoableAction):
+
+    """An action that consists of several actions, which are undone and
+    redone together"""
+
+    restorable = True
+
+    def __init__(self, description):
+        UndoableAction.__init__(self, description)
+        self.actions = []
+
+    def add_action(self, action):
+        """Adds an action to the compound action
+
+        Args:
+
+            action: The action that should be added. It has to be already
+            done.
+        """
+        self.actions.append(action)
+
+    def redo(self):
+        """Redoes the actions in the order they were added"""
+        for action in self.actions:
+            action.redo()
+
+    def undo(self):
+        """Undoes the actions in the reverse order they were added"""
+        for action in reversed(self.actions):
+            action.undo()
+
+    def get_size(self):
+        """Returns an estimate of the memory the action uses, in bytes"""
+        size = UndoableAction.get_size(self)
+        for action in self.actions:
+            size += action.get_size()
+        return size
+
+    def to_record(self):
+        """Returns the data of the done action as a value that can be
+        pickled, or None if any of the actions can not be stored that way"""
+        records = []
+        for action in self.actions:
+            record = action.get_record()
+            if record is None:
+                return None
+            records.append((type(action), record))
+        return self.description, records
+
+    @classmethod
+    def from_record(cls, record, context):
+        """Recreates an action from the data returned by to_record
+
+        Args:
+
+            record: The data of the action
+
+            context: The context of the UndoManager the action belongs to
+        """
+        description, records = record
+        action = cls(description)
+        for action_type, action_record in records:
+            action.add_action(action_type.from_record(action_record, context))
+        return action
+
+
+class ActionStack(deque):
+
+    """A deque of actions and their estimated sizes. The entries below
+    spill_cursor were already offered to the spill file, so the memory limit
+    only has to look at the newer ones."""
+
+    def __init__(self, iterable=(), maxlen=None):
+        deque.__init__(self, iterable, maxlen)
+        self.spill_cursor = 0
+
+    def append(self, entry):
+        """Puts an entry on top of the stack. The oldest entry is dropped if
+        the stack is full.
+
+        Args:
+
+            entry: A tuple of the action and its size
+        """
+        if len(self) == self.maxlen and self.spill_cursor > 0:
+            self.spill_cursor -= 1
+        deque.append(self, entry)
+
+    def pop(self):
+        """Removes and returns the entry on top of the stack"""
+        entry = deque.pop(self)
+        self.spill_cursor = min(self.spill_cursor, len(self))
+        return entry
+
+    def popleft(self):
+        """Removes and returns the oldest entry of the stack"""
+        entry = deque.popleft(self)
+        if self.spill_cursor > 0:
+            self.spill_cursor -= 1
+        return entry
+
+    def clear(self):
+        """Removes all entries"""
+        deque.clear(self)
+        self.spill_cursor = 0
+
 
 class UndoManager(object):
 
-    """Manages undoing of undo_actions"""
+    """Manages undoing of undo_actions. The stacks hold tuples of the actions
+    and their estimated sizes."""
+
+    def __init__(self, max_undo=50, max_bytes=None, spill=False,
+                 context=None, merge_window=1.0):
+        """Constructor
+
+        Args:
+
+            max_undo: The maximum number of undoable and redoable actions
+
+            max_bytes: The estimated memory the actions may use. When the
+            actions use more the oldest ones are spilled or dropped. If None
+            the memory is not limited.
+
+            spill: If True actions that would use more memory than
+            allowed are moved to a temporary file instead of being dropped,
+            if they support to_record.
+
+            context: Passed to from_record when spilled actions are restored
 
-    def __init__(self, max_undo=50):
-        self.max_undo = max_undo
-        self.undo_actions = []
-        self.redo_actions = []
+            merge_window: An action is offered to the previously added action
+            to merge with if it is added less than this many seconds later
+
+        The journal attribute can be set to an object with action_done,
+        action_undone and action_redone methods, which are called with the
+        action whenever one is added, undone or redone.
+        """
+        self.__max_undo = max_undo
+        self.undo_actions = ActionStack(maxlen=max_undo)
+        self.redo_actions = ActionStack(maxlen=max_undo)
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.context = context
+        self.used_bytes = 0
+        self.spill_file = None
+        self.journal = None
+        self.merge_window = merge_window
+        self.last_added = None
+        self.last_added_time = 0.0
+        self.transaction = None
+        self.transaction_depth = 0
+
+    @property
+    def max_undo(self):
+        """Returns the maximum number of undoable and redoable actions"""
+        return self.__max_undo
+
+    @max_undo.setter
+    def max_undo(self, value):
+        """Sets the maximum number of undoable and redoable actions. The
+        oldest actions are dropped if there are more.
+
+        Args:
+
+            value: The new maximum
+        """
+        self.__max_undo = value
+        self.undo_actions = self.resize_stack(self.undo_actions, value)
+        self.redo_actions = self.resize_stack(self.redo_actions, value)
+        self.used_bytes = sum(size for _, size in self.undo_actions)
+        self.used_bytes += sum(size for _, size in self.redo_actions)
+
+    @staticmethod
+    def resize_stack(stack, maxlen):
+        """Returns a copy of a stack with a different maximum length. The
+        oldest actions are dropped if there are more.
+
+        Args:
+
+            stack: The undo_actions or redo_actions ActionStack
+
+            maxlen: The new maximum length
+        """
+        resized = ActionStack(stack, maxlen=maxlen)
+        dropped = len(stack) - len(resized)
+        resized.spill_cursor = max(stack.spill_cursor - dropped, 0)
+        return resized
+
+    @property
+    def in_transaction(self):
+        """Returns whether a transaction is open"""
+        return self.transaction is not None
+
+    def begin_transaction(self, description):
+        """Starts a transaction. Actions that are added until the
+        transaction is committed are grouped into one compound action.
+        Transactions can be nested, the actions are grouped until the
+        outermost transaction is committed.
+
+        Args:
+
+            description: The description of the compound action
+        """
+        if self.transaction is None:
+            self.transaction = CompoundAction(description)
+        self.transaction_depth += 1
+
+    def commit_transaction(self):
+        """Ends a transaction. When the outermost transaction ends, its
+        compound action is added to the undo list, if any actions were added
+        during the transaction.
+
+        Raises:
+
+            UndoError if no transaction was open
+        """
+        if self.transaction is None:
+            raise UndoError("No transaction is open")
+        self.transaction_depth -= 1
+        if self.transaction_depth > 0:
+            return
+        transaction = self.transaction
+        self.transaction = None
+        if transaction.actions:
+            self.add_action(transaction)
 
     @property
     def undo_count(self):
@@ -74,41 +345,196 @@ class UndoManager(object):
 
             Action that should be added
 
+        Returns: True if the action was merged into the previously added
+        action, False if not
+        """
+        if self.transaction is not None:
+            self.used_bytes -= sum(size for _, size in self.redo_actions)
+            self.redo_actions.clear()
+            self.transaction.add_action(action)
+            return False
+        now = time.time()
+        if self.merge_action(action, now):
+            self.last_added_time = now
+            return True
+        self.used_bytes -= sum(size for _, size in self.redo_actions)
+        self.redo_actions.clear()
+        self.push_action(self.undo_actions, action)
+        self.last_added = action
+        self.last_added_time = now
+        if self.journal is not None:
+            self.journal.action_done(action)
+        return False
+
+    def merge_action(self, action, now):
+        """Tries to merge an action into the previously added action, if
+        that is still the newest undoable action and was added less than
+        merge_window seconds ago
+
+        Args:
+
+            action: The action
+
+            now: The current time
+
+        Returns: True if the action was merged, False if not
+        """
+        if (self.last_added is None or not self.undo_actions or
+                now - self.last_added_time > self.merge_window):
+            return False
+        last, size = self.undo_actions[-1]
+        if last is not self.last_added or not last.merge(action):
+            return False
+        new_size = last.get_size()
+        self.undo_actions[-1] = (last, new_size)
+        self.used_bytes += new_size - size
+        self.enforce_memory_limit()
+        return True
+
+    def push_action(self, stack, action):
+        """Puts an action on top of a stack and enforces the memory limit
+
+        Args:
+
+            stack: The undo_actions or redo_actions ActionStack
+
+            action: The action
+        """
+        if stack.maxlen == 0:
+            return
+        # The deque drops the oldest action when it is full
+        if len(stack) == stack.maxlen:
+            self.used_bytes -= stack[0][1]
+        size = action.get_size()
+        stack.append((action, size))
+        self.used_bytes += size
+        self.enforce_memory_limit()
+
+    def pop_action(self, stack):
+        """Takes the action from the top of a stack. Spilled actions are
+        restored.
+
+        Args:
+
+            stack: The undo_actions or redo_actions ActionStack
+
+        Raises:
+
+            IndexError if the stack is empty
+        """
+        action, size = stack.pop()
+        self.used_bytes -= size
+        if isinstance(action, SpilledAction):
+            action = self.restore_action(action)
+        return action
+
+    def enforce_memory_limit(self):
+        """Spills or drops the oldest actions until the actions use less
+        memory than max_bytes. The newest undoable and the newest redoable
+        action are always kept in memory."""
+        if self.max_bytes is None or self.used_bytes <= self.max_bytes:
+            return
+        if self.spill:
+            for stack in (self.undo_actions, self.redo_actions):
+                while (self.used_bytes > self.max_bytes and
+                       stack.spill_cursor < len(stack) - 1):
+                    index = stack.spill_cursor
+                    stack.spill_cursor += 1
+                    action, size = stack[index]
+                    spilled = self.spill_action(action)
+                    if spilled is not None:
+                        stack[index] = (spilled, 0)
+                        self.used_bytes -= size
+        while (self.used_bytes > self.max_bytes and
+               len(self.undo_actions) > 1):
+            self.used_bytes -= self.undo_actions.popleft()[1]
+        while (self.used_bytes > self.max_bytes and
+               len(self.redo_actions) > 1):
+            self.used_bytes -= self.redo_actions.popleft()[1]
+
+    def spill_action(self, action):
+        """Writes an action to the spill file
+
+        Args:
+
+            action: The action
+
+        Returns: A SpilledAction that refers to the written data, or None
+        if the action has no record.
         """
-        self.redo_actions = []
-        if len(self.undo_actions) >= self.max_undo:
-            del self.undo_actions[0]
-        self.undo_actions.append(action)
+        record = action.get_record()
+        if record is None:
+            return None
+        data = pickle.dumps((type(action), record), pickle.HIGHEST_PROTOCOL)
+        try:
+            if self.spill_file is None:
+                self.spill_file = tempfile.TemporaryFile(
+                    prefix="fife-rpg-editor-undo")
+            self.spill_file.seek(0, os.SEEK_END)
+            offset = self.spill_file.tell()
+            self.spill_file.write(data)
+        except (IOError, OSError) as error:
+            print(error)
+            return None
+        return SpilledAction(action.description, offset, len(data))
+
+    def restore_action(self, spilled):
+        """Reads an action from the spill file
+
+        Args:
+
+            spilled: The SpilledAction that refers to the action
+        """
+        self.spill_file.seek(spilled.offset)
+        action_type, record = pickle.loads(
+            self.spill_file.read(spilled.length))
+        return action_type.from_record(record, self.context)
+
+    def clear(self):
+        """Removes all actions and the spill file"""
+        self.undo_actions.clear()
+        self.redo_actions.clear()
+        self.used_bytes = 0
+        self.last_added = None
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
 
     def get_next_undo_action(self):
         """Get the undo action that would be performed with a call to
         :py:meth:`.undo_action`"""
-        return self.undo_actions[-1]
+        return self.undo_actions[-1][0]
 
     def get_next_redo_action(self):
         """Get the redo action that would be performed with a call to
         :py:meth:`.redo_action`"""
-        return self.redo_actions[-1]
+        return self.redo_actions[-1][0]
 
     def undo_action(self):
         """Undoes the last added action"""
+        if self.transaction is not None:
+            raise UndoError("Can't undo while a transaction is open")
+        self.last_added = None
         try:
-            action = self.undo_actions.pop()
+            action = self.pop_action(self.undo_actions)
             action.undo()
-            if len(self.redo_actions) >= self.max_undo:
-                del self.redo_actions[0]
-            self.redo_actions.append(action)
+            self.push_action(self.redo_actions, action)
+            if self.journal is not None:
+                self.journal.action_undone(action)
         except IndexError:
             raise UndoError("Nothing to undo")
 
     def redo_action(self):
         """Redo the last undone action"""
+        if self.transaction is not None:
+            raise UndoError("Can't redo while a transaction is open")
+        self.last_added = None
         try:
-            action = self.redo_actions.pop()
+            action = self.pop_action(self.redo_actions)
             action.redo()
-            if len(self.undo_actions) >= self.max_undo:
-                del self.undo_actions[0]
-            self.undo_actions.append(action)
+            self.push_action(self.undo_actions, action)
+            if self.journal is not None:
+                self.journal.action_redone(action)
 
         except IndexError:
             raise UndoError("Nothing to redo")
@@ -20,11 +20,92 @@
 .. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
 """
 
+import pickle
+import sys
+
 from fife import fife
 
 from .undo import UndoableAction
 
 
+def get_instance_record(instance):
+    """Returns the data needed to recreate an instance as a tuple of the
+    layer data, the coordinates, the object data, the rotation and the name
+
+    Args:
+
+        instance: A fife.Instance
+    """
+    location = instance.getLocation()
+    layer = location.getLayer()
+    exact = location.getExactLayerCoordinates()
+    fife_object = instance.getObject()
+    return ((layer.getId(), layer.getMap().getId()),
+            (exact.x, exact.y, exact.z),
+            (fife_object.getId(), fife_object.getNamespace()),
+            instance.getRotation(), instance.getId() or None)
+
+
+def get_coords_data(coords):
+    """Returns coordinates as a tuple of 3 numbers
+
+    Args:
+
+        coords: A fife.ModelCoordinate, a fife.ExactModelCoordinate or
+        an iterable with 3 numbers
+    """
+    try:
+        return tuple(coords)
+    except TypeError:
+        return (coords.x, coords.y, coords.z)
+
+
+def get_object_data(object_or_object_data):
+    """Returns a tuple with the name and namespace of an object
+
+    Args:
+
+        object_or_object_data: Either a fife.Object instance or an iterable
+        with the name and namespace of the object
+    """
+    if isinstance(object_or_object_data, fife.Object):
+        return (object_or_object_data.getId(),
+                object_or_object_data.getNamespace())
+    return tuple(object_or_object_data)
+
+
+def get_layer_data(layer_or_layer_data):
+    """Returns a tuple with the name of a layer and the name of its map
+
+    Args:
+
+        layer_or_layer_data: The layer or a tuple with 2 items: The name
+        of the layer and the map of the layer as a string or an map
+        instance.
+    """
+    if isinstance(layer_or_layer_data, fife.Layer):
+        return (layer_or_layer_data.getId(),
+                layer_or_layer_data.getMap().getId())
+    return (layer_or_layer_data[0], get_layer_map_name(layer_or_layer_data))
+
+
+def get_layer_map_name(layer_or_layer_data):
+    """Returns the name of the map of a layer
+
+    Args:
+
+        layer_or_layer_data: The layer or a tuple with 2 items: The name
+        of the layer and the map of the layer as a string or an map
+        instance.
+    """
+    if isinstance(layer_or_layer_data, fife.Layer):
+        return layer_or_layer_data.getMap().getId()
+    map_or_identifier = layer_or_layer_data[1]
+    if isinstance(map_or_identifier, fife.Map):
+        return map_or_identifier.getId()
+    return map_or_identifier
+
+
 # pylint: disable=abstract-method
 class EditorUndoableAction(UndoableAction):
 
@@ -36,6 +117,54 @@ class EditorUndoableAction(UndoableAction):
             self.editor = Editor(None)
         UndoableAction.__init__(self, description)
         self.editor = editor
+
+    def find_instance(self, layer_data, coords, object_data, identifier):
+        """Looks up an instance by its position, object and name
+
+        Args:
+
+            layer_data: A tuple with the name of the layer and the name of
+            its map
+
+            coords: A tuple with the exact coordinates of the instance
+
+            object_data: A tuple with the name and namespace of the object
+            of the instance
+
+            identifier: The name of the instance or None
+
+        Returns: The first matching instance or None if there is none
+        """
+        grid = self.editor.spatial_index.get_grid(layer_data[1],
+                                                  layer_data[0])
+        if grid is None:
+            return None
+        for instance in grid.query_radius(coords[:2], 0.001):
+            exact = instance.getLocation().getExactLayerCoordinates()
+            fife_object = instance.getObject()
+            if (abs(exact.z - coords[2]) <= 0.001 and
+                    fife_object.getId() == object_data[0] and
+                    fife_object.getNamespace() == object_data[1] and
+                    (instance.getId() or None) == (identifier or None)):
+                return instance
+        if not identifier:
+            return None
+        # Instances of entities are not indexed and may have been moved by
+        # the world, but their names are unique
+        instance = self.editor.get_instance(identifier, layer_data[0],
+                                            layer_data[1])
+        if instance is None:
+            return None
+        fife_object = instance.getObject()
+        if (fife_object.getId() != object_data[0] or
+                fife_object.getNamespace() != object_data[1]):
+            return None
+        return instance
+
+    def get_map_name(self):
+        """Returns the name of the map the action changes, or None if it
+        is not known"""
+        return None
 # pylint: enable=abstract-method
 
 
@@ -43,6 +172,8 @@ class UndoCreateInstance(EditorUndoableAction):
 
     """Class for undoing and redoing the creation of instances"""
 
+    restorable = True
+
     def __init__(self, editor, layer_or_layer_data, coords,
                  object_or_object_data, rotation=0, identifier=None):
         EditorUndoableAction.__init__(self, editor, _("Create instance"))
@@ -51,7 +182,7 @@ class UndoCreateInstance(EditorUndoableAction):
         self.object_or_object_data = object_or_object_data
         self.identifier = identifier
         self.rotation = rotation
-        self.instance = None
+        self.record = None
 
     def redo(self):
         """Calls :py:meth:`.editor.Editor.create_instance` with the variables
@@ -63,40 +194,313 @@ class UndoCreateInstance(EditorUndoableAction):
         instance.setRotation(self.rotation)
         fife.InstanceVisual.create(instance)
 
-        self.instance = instance
+        self.record = get_instance_record(instance)
         return instance
 
     def undo(self):
-        """Calls :py:meth:`.editor.Editor.delete_instance` with the variables
-        of the action."""
-        self.editor.delete_instance(self.instance, self.layer_or_layer_data)
-        self.instance = None
+        """Calls :py:meth:`.editor.Editor.delete_instance` with the instance
+        that was created. The instance is looked up by its record, as it may
+        have been replaced since it was created."""
+        layer_data, coords, object_data, _, identifier = self.to_record()
+        instance = self.find_instance(layer_data, coords, object_data,
+                                      identifier)
+        if instance is None:
+            print("The created instance was not found")
+            return
+        self.editor.delete_instance(instance, self.layer_or_layer_data)
+
+    def get_map_name(self):
+        """Returns the name of the map the instance is created on"""
+        return get_layer_map_name(self.layer_or_layer_data)
+
+    def to_record(self):
+        """Returns the data of the created instance. The data is taken when
+        the instance is created and the instance is found again by it, so
+        the record stays valid when the action is undone and redone."""
+        if self.record is not None:
+            return self.record
+        return (get_layer_data(self.layer_or_layer_data),
+                get_coords_data(self.coords),
+                get_object_data(self.object_or_object_data),
+                self.rotation, self.identifier or None)
+
+    @classmethod
+    def from_record(cls, record, context):
+        """Recreates the action from the data returned by to_record. The
+        instance is looked up when the action is undone.
+
+        Args:
+
+            record: The data of the action
+
+            context: The editor
+        """
+        layer_data, coords, object_data, rotation, identifier = record
+        return cls(context, layer_data, coords, object_data, rotation,
+                   identifier)
+
+
+class UndoCreateInstances(EditorUndoableAction):
+
+    """Class for undoing and redoing the creation of many instances at
+    once"""
+
+    restorable = True
+
+    def __init__(self, editor, layer_or_layer_data, instance_data,
+                 rotation=0):
+        EditorUndoableAction.__init__(self, editor, _("Create instances"))
+        self.layer_or_layer_data = layer_or_layer_data
+        self.instance_data = list(instance_data)
+        self.rotation = rotation
+        self.records = []
+
+    def redo(self):
+        """Calls :py:meth:`.editor.Editor.create_instances` with the variables
+        of the action and returns the result."""
+        instances = self.editor.create_instances(self.layer_or_layer_data,
+                                                 self.instance_data)
+        self.records = []
+        for instance in instances:
+            instance.setRotation(self.rotation)
+            fife.InstanceVisual.create(instance)
+            _, coords, object_data, _, identifier = get_instance_record(
+                instance)
+            self.records.append((coords, object_data, identifier))
+        return instances
+
+    def undo(self):
+        """Calls :py:meth:`.editor.Editor.delete_instances` with the created
+        instances, which are looked up by their records."""
+        layer_data, instance_data, _ = self.to_record()
+        instances = []
+        for coords, object_data, identifier in instance_data:
+            instance = self.find_instance(layer_data, coords, object_data,
+                                          identifier)
+            if instance is not None:
+                instances.append(instance)
+        self.editor.delete_instances(instances, self.layer_or_layer_data)
+
+    def get_map_name(self):
+        """Returns the name of the map the instances are created on"""
+        return get_layer_map_name(self.layer_or_layer_data)
+
+    def get_size(self):
+        """Returns an estimate of the memory the action uses, in bytes"""
+        size = EditorUndoableAction.get_size(self)
+        for data in self.instance_data:
+            size += sys.getsizeof(data)
+        for data in self.records:
+            size += sys.getsizeof(data)
+        return size
+
+    def to_record(self):
+        """Returns the data of the created instances. The data is taken when
+        the instances are created and the instances are found again by it,
+        so the record stays valid when the action is undone and redone."""
+        instance_data = list(self.records)
+        if not instance_data:
+            for coords, object_or_object_data, identifier in \
+                    self.instance_data:
+                instance_data.append((get_coords_data(coords),
+                                      get_object_data(object_or_object_data),
+                                      identifier or None))
+        return (get_layer_data(self.layer_or_layer_data), instance_data,
+                self.rotation)
+
+    @classmethod
+    def from_record(cls, record, context):
+        """Recreates the action from the data returned by to_record. The
+        instances are looked up when the action is undone.
+
+        Args:
+
+            record: The data of the action
+
+            context: The editor
+        """
+        layer_data, instance_data, rotation = record
+        return cls(context, layer_data, instance_data, rotation)
 
 
 class UndoRemoveInstance(EditorUndoableAction):
 
     """Class for undoing and redoing the removing of instances"""
 
+    restorable = True
+
     def __init__(self, editor, instance):
         EditorUndoableAction.__init__(self, editor, _("Create instance"))
-        location = instance.getLocation()
+        # Only used until the action is done the first time
         self.instance = instance
-        self.coords = location.getExactLayerCoordinates()
-        self.layer = location.getLayer()
-        self.object = instance.getObject()
-        self.rotation = instance.getRotation()
-        self.identifier = instance.getId()
+        (self.layer_data, self.coords, self.object_data, self.rotation,
+         self.identifier) = get_instance_record(instance)
 
     def redo(self):
         """Calls :py:meth:`.editor.Editor.delete_instance` with the variables
-        of the action"""
-        self.editor.delete_instance(self.instance)
+        of the action. When the action is redone the instance is looked up
+        by its data, as it may have been replaced since it was removed."""
+        instance = self.instance
+        self.instance = None
+        if instance is None:
+            instance = self.find_instance(self.layer_data, self.coords,
+                                          self.object_data, self.identifier)
+            if instance is None:
+                print("The instance to remove was not found")
+                return
+        self.editor.delete_instance(instance)
 
     def undo(self):
         """Calls :py:meth:`.editor.Editor.delete_instance` with the variables
         of the action."""
-        instance = self.editor.create_instance(self.layer, self.coords,
-                                               self.object, self.identifier)
+        instance = self.editor.create_instance(self.layer_data, self.coords,
+                                               self.object_data,
+                                               self.identifier)
         instance.setRotation(self.rotation)
         fife.InstanceVisual.create(instance)
-        self.instance = instance
+
+    def get_map_name(self):
+        """Returns the name of the map the instance is removed from"""
+        return self.layer_data[1]
+
+    def to_record(self):
+        """Returns the data needed to recreate the removed instance"""
+        return (self.layer_data, self.coords, self.object_data,
+                self.rotation, self.identifier)
+
+    @classmethod
+    def from_record(cls, record, context):
+        """Recreates the action from the data returned by to_record
+
+        Args:
+
+            record: The data of the action
+
+            context: The editor
+        """
+        action = cls.__new__(cls)
+        EditorUndoableAction.__init__(action, context, _("Create instance"))
+        # Looked up when the action is redone
+        action.instance = None
+        (action.layer_data, action.coords, action.object_data,
+         action.rotation, action.identifier) = record
+        return action
+
+
+class UndoChangeProperty(EditorUndoableAction):
+
+    """Class for undoing and redoing changes of the properties of instances
+    and their entities. Changes of the same property of the same instance
+    that follow each other quickly are merged. The property is changed by
+    calling the property_setter of the editor."""
+
+    restorable = True
+
+    def __init__(self, editor, instance, old_identifier, section,
+                 property_name, old_value, new_value):
+        """Constructor
+
+        Args:
+
+            editor: The editor
+
+            instance: The fife.Instance that was changed
+
+            old_identifier: The name of the instance before the change
+
+            section: The section of the property
+
+            property_name: The name of the property
+
+            old_value: The value before the change
+
+            new_value: The value after the change
+        """
+        EditorUndoableAction.__init__(self, editor, _("Change property"))
+        record = get_instance_record(instance)
+        self.layer_data, self.coords, self.object_data = record[:3]
+        self.new_identifier = record[4]
+        self.old_identifier = old_identifier or None
+        self.section = section
+        self.property_name = property_name
+        self.old_value = old_value
+        self.new_value = new_value
+
+    def set_value(self, identifier, value):
+        """Looks up the instance and changes the property
+
+        Args:
+
+            identifier: The name of the instance before the change
+
+            value: The new value of the property
+        """
+        instance = self.find_instance(self.layer_data, self.coords,
+                                      self.object_data, identifier)
+        if instance is None:
+            print("The changed instance was not found")
+            return
+        self.editor.property_setter(instance, self.section,
+                                    self.property_name, value)
+
+    def redo(self):
+        """Sets the property to the new value"""
+        self.set_value(self.old_identifier, self.new_value)
+
+    def undo(self):
+        """Sets the property back to the old value"""
+        self.set_value(self.new_identifier, self.old_value)
+
+    def merge(self, action):
+        """Takes over the new value of a change of the same property
+
+        Args:
+
+            action: The newer action
+
+        Returns: True if the action was merged, False if not
+        """
+        if (not isinstance(action, UndoChangeProperty) or
+                action.section != self.section or
+                action.property_name != self.property_name or
+                action.layer_data != self.layer_data or
+                action.coords != self.coords or
+                action.object_data != self.object_data or
+                action.old_identifier != self.new_identifier):
+            return False
+        self.new_value = action.new_value
+        self.new_identifier = action.new_identifier
+        return True
+
+    def get_map_name(self):
+        """Returns the name of the map of the changed instance"""
+        return self.layer_data[1]
+
+    def to_record(self):
+        """Returns the data of the change, or None if the values can not be
+        pickled"""
+        try:
+            pickle.dumps((self.old_value, self.new_value),
+                         pickle.HIGHEST_PROTOCOL)
+        except Exception:  # pylint: disable=broad-except
+            return None
+        return (self.layer_data, self.coords, self.object_data,
+                self.old_identifier, self.new_identifier, self.section,
+                self.property_name, self.old_value, self.new_value)
+
+    @classmethod
+    def from_record(cls, record, context):
+        """Recreates the action from the data returned by to_record
+
+        Args:
+
+            record: The data of the action
+
+            context: The editor
+        """
+        action = cls.__new__(cls)
+        EditorUndoableAction.__init__(action, context, _("Change property"))
+        (action.layer_data, action.coords, action.object_data,
+         action.old_identifier, action.new_identifier, action.section,
+         action.property_name, action.old_value, action.new_value) = record
+        return action
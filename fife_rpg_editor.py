@@ -71,6 +71,8 @@ from editor.systems import Systems, AvailableSystems
 from editor.actions import Actions, AvailableActions
 from editor.behaviours import Behaviours, AvailableBehaviours
 from editor.common import get_entity
+from editor.scheduler import TaskScheduler
+from editor.journal import UndoJournal, JOURNAL_EXTENSION
 
 BASIC_SETTINGS = """<?xml version='1.0' encoding='UTF-8'?>
 <Settings>
@@ -158,7 +160,21 @@ class EditorApplication(RPGApplicationCEGUI):
         self.entities = {}
         self._objects_imported_callbacks = []
         self.selected_object = None
+        self.scheduler = TaskScheduler()
         self.editor = Editor(self.engine)
+        undo_budget = float(self.settings.get("fife-rpg", "UndoMemoryBudget",
+                                              0.0))
+        if undo_budget > 0:
+            self.editor.undo_manager.max_bytes = int(undo_budget * 1024 * 1024)
+        self.editor.undo_manager.spill = self.settings.get(
+            "fife-rpg", "UndoSpillToDisk", False)
+        self.editor.undo_manager.merge_window = float(self.settings.get(
+            "fife-rpg", "UndoMergeWindow", 1.0))
+        self.undo_journal = None
+        if self.settings.get("fife-rpg", "UndoJournal", True):
+            self.undo_journal = UndoJournal(self.editor,
+                                            self.get_journal_path)
+            self.editor.undo_manager.journal = self.undo_journal
         self.editor_gui = EditorGui(self)
         self.current_dialog = None
 
@@ -303,6 +319,8 @@ class EditorApplication(RPGApplicationCEGUI):
         ActionManager.clear_commands()
         SystemManager.clear_systems()
         BehaviourManager.clear_behaviours()
+        if self.undo_journal is not None:
+            self.undo_journal.discard_all()
         self.editor.delete_maps()
         self.editor.delete_objects()
         if self.project_source is not None:
@@ -427,6 +445,8 @@ class EditorApplication(RPGApplicationCEGUI):
         game_map.update_entities()
         self.update_agents(game_map)
         self.editor_gui.current_toolbar.activate()
+        if self.undo_journal is not None:
+            self.undo_journal.discard(fife_map.getId())
         if map_name in self.changed_maps:
             self.changed_maps.remove(map_name)
 
@@ -589,7 +609,9 @@ class EditorApplication(RPGApplicationCEGUI):
         Derived classes can specialize this for unique behavior.
         This is called every frame.
         """
+        self.scheduler.process_completed()
         self.editor_gui.update_toolbar_contents()
+        self.editor_gui.update_pending_property_editor()
         if self.world:
             try:
                 self.world.pump(0)
@@ -770,11 +792,68 @@ class EditorApplication(RPGApplicationCEGUI):
         """Callback for when a map was loaded"""
 
         fife_map = game_map.fife_map
-        for layer in self.editor.get_layers(fife_map):
-            for instance in layer.getInstances():
-                filename = instance.getObject().getFilename()
-                map_name = fife_map.getId()
-                self.editor.increase_refcount(filename, map_name)
+        # Maps that were opened with Editor.load_map are already indexed
+        if not self.editor.is_map_indexed(fife_map):
+            world = self.world
+
+            def is_entity_instance(instance):
+                """Instances of entities are managed by the world"""
+                return world.is_identifier_used(instance.getId())
+
+            instance_count, index_time = self.editor.index_map(
+                fife_map, is_entity_instance)
+            print("Map %s: indexed %d instances in %.2fs" %
+                  (fife_map.getId(), instance_count, index_time))
+        self.restore_journal(game_map.name, fife_map.getId())
+
+    def get_journal_path(self, map_name):
+        """Returns the path to the undo journal of a map
+
+        Args:
+
+            map_name: The name of the fife map
+
+        Returns: The path or None if the map was not saved yet
+        """
+        try:
+            filename = self.editor.get_map(map_name).getFilename()
+        except ValueError:
+            return None
+        if not filename:
+            return None
+        if self.project_dir is not None:
+            filename = os.path.join(self.project_dir, filename)
+        return os.path.abspath(filename) + JOURNAL_EXTENSION
+
+    def restore_journal(self, map_name, fife_map_name):
+        """Offers to restore the unsaved changes of a map from its undo
+        journal, which is left behind when the editor was not closed
+        properly
+
+        Args:
+
+            map_name: The name of the map
+
+            fife_map_name: The name of the fife map
+        """
+        if self.undo_journal is None:
+            return
+        entries = self.undo_journal.read(fife_map_name)
+        if not entries:
+            return
+        import tkinter.messagebox
+        answer = tkinter.messagebox.askyesno(
+            _("Restore changes"),
+            _("The map %s has unsaved changes from an earlier session. "
+              "Restore them?") % map_name)
+        if not answer:
+            self.undo_journal.discard(fife_map_name)
+            return
+        undo_manager = self.editor.undo_manager
+        for action in self.undo_journal.replay(fife_map_name, entries):
+            undo_manager.push_action(undo_manager.undo_actions, action)
+        if map_name not in self.changed_maps:
+            self.changed_maps.append(map_name)
 
     def hide_map_entities(self, map_name):
         """Hides the entities of all maps
@@ -820,6 +899,11 @@ class EditorApplication(RPGApplicationCEGUI):
         if self.current_dialog:
             return
         if self.editor_gui.ask_save_changed():
+            self.scheduler.shutdown()
+            self.editor_gui.shutdown_toolbars()
+            if self.undo_journal is not None:
+                self.undo_journal.discard_all()
+                self.undo_journal.close()
             self.quitRequested = True
 
     def edit_components(self):